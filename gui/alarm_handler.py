@@ -1,8 +1,20 @@
 
+import time
+from bisect import bisect_left
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from messagebox import MessageBox
-from communication.esp32serial import ESP32Alarm, ESP32Warning
+from communication.esp32serial import ESP32Alarm, ESP32Warning, ESP32Exception, LATENCY_BINS, STALL_PERIODS
+
+
+class _AlarmEvents(QtCore.QObject):
+    '''
+    Carries the alarm events from the serial reader thread to the
+    GUI thread
+    '''
+
+    # the bitmasks use the 32 bits: they do not fit a C int
+    received = QtCore.pyqtSignal(object, object, float)
 
 
 class AlarmHandler:
@@ -10,19 +22,37 @@ class AlarmHandler:
     This class starts a QTimer dedicated
     to checking is there are any errors
     or warnings coming from ESP32
+
+    If the ESP supports the "alarm_events" protocol feature, it
+    reports the alarm and warning changes as soon as they happen
+    while streaming, and the QTimer only polls them as a heartbeat,
+    every alarm_heartbeat_interval seconds, as long as the samples or
+    the events keep coming.
+
+    The time from the moment the GUI learns about new alarms or
+    warnings (the event is received, or the poll is sent) to the
+    moment they are shown is measured, see alarm_latency().
+
+    The onsets and clears of the alarms and warnings, and their
+    snoozes, are added to the journal.
     '''
 
-    def __init__(self, config, esp32):
+    def __init__(self, config, esp32, dispatcher, journal=None):
         '''
         Constructor
 
         arguments:
         - config: the dictionary storing the configuration
         - esp32: the esp32serial object
+        - dispatcher: the ESP32Dispatcher running the ESP requests
+        - journal: the Journal of the events, if any
         '''
 
         self._config = config
         self._esp32 = esp32
+        self._dispatcher = dispatcher
+        self._journal = journal
+        self._request = None
 
         self._alarm_raised = False
         self._warning_raised = False
@@ -30,9 +60,38 @@ class AlarmHandler:
         self._msg_err = MessageBox()
         self._msg_war = MessageBox()
 
+        # the bitmasks shown last, and the latency statistics per
+        # source ('event' or 'poll')
+        self._shown = (0, 0)
+        self._latency = {}
+
+        # the alarm timer ticks since the last poll, and when the last
+        # alarm event was received
+        self._ticks = 0
+        self._last_event = float('-inf')
+
+        self._events = None
+        if 'alarm_events' in self._esp32.protocol:
+            self._events = _AlarmEvents()
+            self._events.received.connect(self._alarm_event)
+            self._esp32.subscribe_alarms(self._events.received.emit)
+
         self._alarm_timer = QtCore.QTimer()
         self._alarm_timer.timeout.connect(self.handle_alarms)
-        self._alarm_timer.start(config["alarminterval"] * 1000)
+        self._alarm_timer.start(int(config["alarminterval"] * 1000))
+
+    def _poll_interval(self):
+        '''
+        returns: the polling interval in seconds, longer when the ESP
+        reports the changes by itself: while the stream is not stalled,
+        or an alarm event came within the last STALL_PERIODS intervals
+        '''
+        interval = self._config["alarminterval"]
+        if self._events is not None and self._esp32.streaming:
+            recent = time.monotonic() - self._last_event < STALL_PERIODS * interval
+            if recent or not self._esp32.stream_stalled_for():
+                return self._config.get("alarm_heartbeat_interval", 10)
+        return interval
 
 
 
@@ -40,30 +99,92 @@ class AlarmHandler:
         '''
         The callback method which is called periodically
         to check if the ESP raised any alarm or warning.
+        The request is queued in the dispatcher, and
+        show_alarms is called with the result.
+        The timer ticks every alarminterval, and the ticks
+        within the polling interval are skipped, so the
+        polling speeds up as soon as the events stop. The
+        first tick always polls.
+        '''
+
+        self._ticks += 1
+        if (self._request is not None and
+                self._ticks * self._config["alarminterval"] < self._poll_interval()):
+            return
+        self._ticks = 0
+
+        # don't pile up requests if the ESP is slower than the timer
+        if self._request is not None and not self._request.done():
+            return
+
+        # Retrieve alarms and warnings from the ESP
+        sent = time.monotonic()
+        self._request = self._dispatcher.submit(
+                self._dispatcher.PRIORITY_ALARM,
+                self._read_alarms,
+                callback=lambda statuses: self.show_alarms(statuses, 'poll', sent),
+                errback=self._comm_error)
+
+    def _alarm_event(self, alarm, warning, received):
+        '''
+        Shows the alarms and warnings reported by the ESP.
+        Runs in the GUI thread.
+        '''
+        self._last_event = received
+        self.show_alarms((ESP32Alarm(alarm), ESP32Warning(warning)), 'event', received)
+
+    def _read_alarms(self):
+        '''
+        Reads alarms and warnings in one request.
+        Runs in the dispatcher thread.
+        '''
+        statuses = self._esp32.get_many(['alarm', 'warning'], kind="alarm")
+
+        return (ESP32Alarm(int(statuses['alarm'])),
+                ESP32Warning(int(statuses['warning'])))
+
+    def _comm_error(self, error):
+        '''
+        Shows the error occurred while retrieving the alarms,
+        unless the ESP has been silent for less than comm_error_timeout.
+        '''
+        if (isinstance(error, ESP32Exception) and
+                self._esp32.link_down_for() < self._config['comm_error_timeout']):
+            print('Ignoring ESP error:', error)
+            return
+
+        err_msg = "Severe hardware communication error. "
+        err_msg += "Cannot retrieve alarm and warning statuses from hardware."
+        msg = MessageBox()
+        fn = msg.critical("Critical",
+                          err_msg,
+                          str(error),
+                          "Communication error",
+                          { msg.Retry: lambda: None,
+                            msg.Abort: lambda: None })
+        fn()
+
+    def show_alarms(self, statuses, source=None, since=None):
+        '''
         If an alarm or warning is raised, a pop up
         window appears, showing the list of alarms and
         warnings. If more alarms or warnings add up, the
         window is updated automatically showing the latest
         errors.
+
+        arguments:
+        - statuses: the (ESP32Alarm, ESP32Warning) pair read from the ESP
+        - source: where they come from, 'event' or 'poll'
+        - since: the time.monotonic() the GUI learned about them
+
+        A poll sent before the last event is ignored: its reply may be
+        older than the event.
         '''
 
-        # Retrieve alarms and warnings from the ESP
-        try:
-            esp32alarm = self._esp32.get_alarms()
-            esp32warning = self._esp32.get_warnings()
-        except Exception as error:
-            esp32alarm = None
-            esp32warning = None
-            err_msg = "Severe hardware communication error. "
-            err_msg += "Cannot retrieve alarm and warning statuses from hardware."
-            msg = MessageBox()
-            fn = msg.critical("Critical",
-                              err_msg,
-                              str(error),
-                              "Communication error",
-                              { msg.Retry: lambda: None,
-                                msg.Abort: lambda: None })
-            fn()
+        if source == 'poll' and since is not None and since < self._last_event:
+            return
+
+        esp32alarm, esp32warning = statuses
 
         #
         # ALARMS
@@ -114,6 +235,62 @@ class AlarmHandler:
                 self._msg_war.setDetailedText("\n".join(errors_full))
                 self._msg_war.raise_()
 
+        shown = (esp32alarm.number, esp32warning.number)
+        if shown != self._shown:
+            if self._journal is not None:
+                self._log_changes('alarm', ESP32Alarm, self._shown[0], shown[0])
+                self._log_changes('warning', ESP32Warning, self._shown[1], shown[1])
+            self._shown = shown
+            if since is not None and (esp32alarm or esp32warning):
+                self._account(source, time.monotonic() - since)
+
+    def _log_changes(self, kind, status, old, new):
+        '''
+        Adds the bits set and cleared between two statuses to the
+        journal
+
+        arguments:
+        - kind: 'alarm' or 'warning'
+        - status: the class decoding them, ESP32Alarm or ESP32Warning
+        - old, new: the previous and the current numbers
+        '''
+        for error in status(new & ~old).strerror_all(append_err_no=True):
+            self._journal.add(kind, error)
+        for error in status(old & ~new).strerror_all(append_err_no=True):
+            self._journal.add(kind + '_clear', error)
+
+    def _account(self, source, latency):
+        '''
+        Adds a latency to the statistics of a source
+        '''
+        stats = self._latency.setdefault(source, {
+            "count": 0, "total": 0., "max": 0., "last": 0.,
+            "histogram": [0] * (len(LATENCY_BINS) + 1)})
+        stats["count"] += 1
+        stats["total"] += latency
+        stats["max"] = max(stats["max"], latency)
+        stats["last"] = latency
+        stats["histogram"][bisect_left(LATENCY_BINS, latency)] += 1
+
+    def alarm_latency(self):
+        '''
+        The time taken to show new alarms or warnings, from the
+        moment the GUI learned about them, per source
+
+        returns: a dict 'event'/'poll' -> dict with:
+        - count: the number of alarm or warning changes shown
+        - mean, max, last: the latencies, in seconds
+        - bins: the upper edges of the histogram bins, in seconds
+        - histogram: the number of changes per bin; the last bin
+                     collects the slower ones
+        '''
+        return {source: dict(count=stats["count"],
+                             mean=stats["total"] / stats["count"],
+                             max=stats["max"], last=stats["last"],
+                             bins=LATENCY_BINS,
+                             histogram=list(stats["histogram"]))
+                for source, stats in self._latency.items()}
+
 
     def ok_worker(self, mode, raised_ones):
         '''
@@ -133,34 +310,43 @@ class AlarmHandler:
         else:
             self._warning_raised = False
 
+        if self._journal is not None:
+            self._journal.add('snooze', '%s: %s' % (mode, ' - '.join(raised_ones.strerror_all())))
+
         # Reset the alarms/warnings in the ESP
         # If the ESP connection fails at this
         # time, raise an error box
-        try:
+        def reset():
             if mode == 'alarm':
                 for alarm_code in raised_ones.unpack():
                     self._esp32.snooze_hw_alarm(alarm_code)
             else:
                 self._esp32.reset_warnings()
-        except Exception as error:
+
+        def reset_error(error):
             msg = MessageBox()
             fn = msg.critical("Critical",
                               "Severe hardware communication error",
                               str(error),
                               "Communication error",
-                              { msg.Retry: lambda: self.ok_worker(mode),
+                              { msg.Retry: lambda: self.ok_worker(mode, raised_ones),
                                 msg.Abort: lambda: None })
             fn()
 
+        self._dispatcher.submit(self._dispatcher.PRIORITY_ALARM, reset,
+                                errback=reset_error)
+
     def raise_alarm(self):
         '''
         Raises an alarm in the ESP
         '''
-        self._esp32.raise_gui_alarm()
+        self._dispatcher.submit(self._dispatcher.PRIORITY_ALARM,
+                                self._esp32.raise_gui_alarm)
 
     def stop_alarm(self, code):
         '''
         Stops an alarm in the ESP
         '''
-        self._esp32.reset_alarms()
+        self._dispatcher.submit(self._dispatcher.PRIORITY_ALARM,
+                                self._esp32.reset_alarms)
 
@@ -2,21 +2,50 @@
 Alarm facility.
 """
 
+import time
 from copy import copy
+import numpy as np
 
 class GuiAlarms:
-    def __init__(self, config, esp32, monitors):
+    '''
+    Checks the samples against the alarm thresholds.
+
+    The alarms config is compiled into arrays, one entry per alarm:
+    the column of its observable in the samples (get_all_fields order)
+    and its set min and max (-inf and +inf where there is none). A
+    block of samples is checked with one vectorized compare, which
+    finds every violated threshold at once; an observable can have
+    several alarms.
+
+    Each alarm is a state machine: it becomes active once its
+    thresholds are violated for onset_delay seconds, and, unless it
+    is latching, clears by itself once the value is back inside the
+    thresholds by more than hysteresis. Latching alarms stay active
+    until cleared from their monitor. The ESP and the monitors are
+    only told about these transitions: the GUI alarm is raised when
+    the first alarm becomes active and snoozed when the last one
+    clears. The writes the previous per-sample checks would have done
+    are counted in suppressed_writes. The transitions are also added
+    to the journal.
+    '''
+
+    def __init__(self, config, esp32, dispatcher, monitors, journal=None):
         '''
         Constructor
 
         arguments:
         - config: the dict config
         - esp32: instance of the esp32serial
+        - dispatcher: the ESP32Dispatcher running the ESP requests
         - monitors: a dict name->Monitor
+        - journal: the Journal of the events, if any
         '''
         self._obs = copy(config["alarms"])
+        self._sampling = config['sampling_interval']
         self._esp32 = esp32
+        self._dispatcher = dispatcher
         self._monitors = monitors
+        self._journal = journal
 
         self._mon_to_obs = {}
         for n, v in self._obs.items():
@@ -25,11 +54,44 @@ class GuiAlarms:
             v['max'] = v.get('max', None)
             v['setmin'] = v.get('setmin', v.get('min'))
             v['setmax'] = v.get('setmax', v.get('max'))
+            v['onset_delay'] = v.get('onset_delay', config.get('alarm_onset_delay', 0))
+            v['hysteresis'] = v.get('hysteresis', 0)
+            v['latching'] = v.get('latching', config.get('alarm_latching', True))
+
+        # the alarms on the sampled observables, in compiled order
+        self._fields = config['get_all_fields']
+        self._names = [n for n, v in self._obs.items() if v['observable'] in self._fields]
+        self._columns = np.array([self._fields.index(self._obs[n]['observable'])
+                                  for n in self._names], dtype=int)
+        self._linked = [self._obs[n]['linked_monitor'] for n in self._names]
+        self._delay = np.array([self._obs[n]['onset_delay'] for n in self._names], dtype=float)
+        self._hysteresis = np.array([self._obs[n]['hysteresis'] for n in self._names], dtype=float)
+        self._latching = np.array([bool(self._obs[n]['latching']) for n in self._names])
+        self._compile_thresholds()
+
+        # the state of each alarm: active or not, and since when its
+        # thresholds are violated (nan if they are not)
+        self._active = np.zeros(len(self._names), dtype=bool)
+        self._violated_since = np.full(len(self._names), np.nan)
 
+        self.esp_writes = 0
+        self.suppressed_writes = 0
 
         self._alarmed_monitors = set()
         self.update_mon_thresholds()
 
+    def _compile_thresholds(self):
+        '''
+        Builds the arrays of the set min and max of the alarms
+        '''
+        def threshold(value, default):
+            return default if value is None else value
+
+        self._setmin = np.array([threshold(self._obs[n]['setmin'], -np.inf)
+                                 for n in self._names], dtype=float)
+        self._setmax = np.array([threshold(self._obs[n]['setmax'], np.inf)
+                                 for n in self._names], dtype=float)
+
     def update_mon_thresholds(self):
         '''
         Send the thresholds to the monitors
@@ -40,47 +102,65 @@ class GuiAlarms:
                                                                   v.get('max'),
                                                                   v.get('setmax'))
 
-    def _get_by_observable(self, observable):
+    def _test_thresholds(self, samples):
         '''
-        Gets the dict consiguration for a
-        particular observable
-        '''
-        for v in self._obs.values():
-            if v['observable'] == observable:
-                return v
-        return None
+        Checks a block of samples against all the thresholds
 
-    def _test_over_threshold(self, item, value):
-        '''
-        Checks if the current value is above
-        threshold (if a threshold exists)
-        '''
-        if item['setmax'] is not None:
-            if value > item["setmax"]:
-                self._esp32.raise_gui_alarm()
-                linked_monitor = self._monitors[item['linked_monitor']]
-                linked_monitor.set_alarm_state(isalarm=True)
-                self._alarmed_monitors.add(linked_monitor.configname)
+        arguments:
+        - samples: a 2-D block of samples, one row per sample in
+                   get_all_fields order
 
-    def _test_under_threshold(self, item, value):
+        returns: two boolean arrays, one row per sample and one
+        column per alarm: the violated thresholds, and the values
+        inside the thresholds by more than the hysteresis
+        '''
+        values = samples[:, self._columns]
+        violated = (values < self._setmin) | (values > self._setmax)
+        inside = ((values >= self._setmin + self._hysteresis) &
+                  (values <= self._setmax - self._hysteresis))
+        return violated, inside
+
+    def _raise(self, alarms):
         '''
-        Checks if the current value is under
-        threshold (if a threshold exists)
+        Shows the alarms that became active on their linked monitors,
+        and raises the GUI alarm on the ESP if it is not yet
+
+        arguments:
+        - alarms: the indexes of the alarms
         '''
-        if item['setmin'] is not None:
-            if value < item["setmin"]:
-                self._esp32.raise_gui_alarm()
-                linked_monitor = self._monitors[item['linked_monitor']]
+        if not self._alarmed_monitors:
+            self._dispatcher.submit(self._dispatcher.PRIORITY_ALARM,
+                                    self._esp32.raise_gui_alarm)
+            self.esp_writes += 1
+            self.suppressed_writes -= 1
+
+        for i in alarms:
+            print('NORMAL: Alarm', self._names[i], 'raised,',
+                  self.suppressed_writes, 'ESP writes suppressed so far')
+            if self._journal is not None:
+                self._journal.add('alarm', 'GUI threshold on %s' % self._names[i])
+            linked_monitor = self._monitors[self._linked[i]]
+            if linked_monitor.configname not in self._alarmed_monitors:
                 linked_monitor.set_alarm_state(isalarm=True)
                 self._alarmed_monitors.add(linked_monitor.configname)
 
-    def _test_thresholds(self, item, value):
+    def _release(self, alarms):
         '''
-        Checks if the current value is above or under
-        threshold (if a threshold exists)
-        '''
-        self._test_over_threshold(item, value)
-        self._test_under_threshold(item, value)
+        Clears the monitors of the alarms that cleared by themselves,
+        if no other alarm is active on them
+
+        arguments:
+        - alarms: the indexes of the alarms
+        '''
+        for i in alarms:
+            if self._journal is not None:
+                self._journal.add('alarm_clear', 'GUI threshold on %s' % self._names[i])
+            name = self._linked[i]
+            others = [j for j, linked in enumerate(self._linked)
+                      if linked == name and self._active[j]]
+            if not others and name in self._alarmed_monitors:
+                # this calls clear_alarm()
+                self._monitors[name].set_alarm_state(isalarm=False)
 
     def clear_alarm(self, name):
         '''
@@ -88,10 +168,22 @@ class GuiAlarms:
         a particular bit, this is why name is an argument here.
         '''
 
+        # the alarms of this monitor start over, and become active
+        # again after their onset delay if still violated
+        for i, linked in enumerate(self._linked):
+            if linked == name:
+                if self._active[i] and self._journal is not None:
+                    self._journal.add('alarm_clear', 'GUI threshold on %s, cleared on %s'
+                                      % (self._names[i], name))
+                self._active[i] = False
+                self._violated_since[i] = np.nan
+
         if name in self._alarmed_monitors:
             self._alarmed_monitors.remove(name)
             if len(self._alarmed_monitors) == 0:
-                self._esp32.snooze_gui_alarm()
+                self._dispatcher.submit(self._dispatcher.PRIORITY_ALARM,
+                                        self._esp32.snooze_gui_alarm)
+                self.esp_writes += 1
 
         #self._esp32.reset_alarms()
         #obs = self._mon_to_obs.get(name, None)
@@ -104,7 +196,7 @@ class GuiAlarms:
         #        self._esp32.snooze_hw_alarm(over_code)
 
 
-    def update_thresholds(observable, minimum, maximum):
+    def update_thresholds(self, observable, minimum, maximum):
         '''
         Updated the thresholds
         '''
@@ -112,17 +204,55 @@ class GuiAlarms:
 
         self._obs[observable]["setmin"] = minimum
         self._obs[observable]["setmax"] = maximum
+        self._compile_thresholds()
+
+
+    def set_samples(self, samples, now=None):
+        '''
+        Checks a block of samples, and updates the alarm states.
+        This is called by the DataHandler
+
+        arguments:
+        - samples: a 2-D block of samples, one row per sample in
+                   get_all_fields order, the last one taken now
+        - now: the time of the last sample, default time.time()
+        '''
+        if now is None:
+            now = time.time()
+
+        violated, inside = self._test_thresholds(samples)
+        first = now - self._sampling * (len(samples) - 1)
+        raised = np.zeros(len(self._names), dtype=bool)
+        released = np.zeros(len(self._names), dtype=bool)
+
+        for t, row_violated, row_inside in zip(first + self._sampling * np.arange(len(samples)),
+                                                violated, inside):
+            since = self._violated_since
+            since[~row_violated] = np.nan
+            since[row_violated & np.isnan(since)] = t
+
+            onset = row_violated & ~self._active & (t - since >= self._delay)
+            clear = self._active & row_inside & ~self._latching
+            self._active |= onset
+            self._active &= ~clear
+            raised |= onset
+            released |= clear
+            released &= ~onset
+
+            # the previous checks wrote to the ESP at every violation
+            self.suppressed_writes += int(row_violated.sum())
 
+        if raised.any():
+            self._raise(np.flatnonzero(raised))
+        if released.any():
+            self._release(np.flatnonzero(released))
 
     def set_data(self, data):
         '''
-        Sets the data. This is called by the
-        DataHandler
+        Checks one sample, as a dict observable->value
         '''
-        for observable in data:
-            item = self._get_by_observable(observable)
-            if item is not None:
-                self._test_thresholds(item, data[observable])
+        sample = np.array([[data.get(f, np.nan) for f in self._fields]], dtype=float)
+        self.set_samples(sample)
 
     def has_valid_minmax(self, name):
         '''
@@ -178,6 +308,7 @@ class GuiAlarms:
         obs = self._mon_to_obs.get(name, None)
         if obs is not None:
             self._obs[obs]['setmin'] = minvalue
+            self._compile_thresholds()
             self.update_mon_thresholds()
 
     def update_max(self, name, maxvalue):
@@ -188,6 +319,7 @@ class GuiAlarms:
         obs = self._mon_to_obs.get(name, None)
         if obs is not None:
             self._obs[obs]['setmax'] = maxvalue
+            self._compile_thresholds()
             self.update_mon_thresholds()
 
 
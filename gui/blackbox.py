@@ -0,0 +1,188 @@
+'''
+Keeps the last minute of samples, and saves it with the following
+seconds when an alarm starts.
+'''
+
+import os
+import glob
+import time
+from queue import Queue
+from threading import Thread
+import numpy as np
+from sample_clock import SampleClock
+
+
+class BlackBox():
+    '''
+    Keeps the samples of the last blackbox_pre_trigger seconds, all
+    the get_all_fields, in a preallocated ring. When an alarm starts,
+    a capture is triggered: once blackbox_post_trigger more seconds
+    of samples came, the samples before and after the trigger are
+    saved to a compressed capture file in the blackbox_path directory.
+    The alarms starting while a capture waits for its post-trigger
+    samples are added to it.
+
+    The files are written by a writer thread, and the oldest ones
+    beyond blackbox_max_captures are removed. A capture file holds
+    (see numpy.load):
+    - times: the time of each sample, in seconds since the epoch
+    - samples: the samples, one row per time, in 'fields' order
+    - fields: the field names
+    - trigger: the time of the first alarm
+    - reasons: the alarms that started during the capture
+    '''
+
+    def __init__(self, config):
+        '''
+        Constructor
+
+        Allocates the ring and starts the writer thread.
+
+        arguments:
+        - config: the config dictionary
+        '''
+
+        self.path = config['blackbox_path']
+        self.fields = config['get_all_fields']
+        sampling = config['sampling_interval']
+        self._clock = SampleClock(sampling)
+        self._pre = int(round(config.get('blackbox_pre_trigger', 60) / sampling))
+        self._post = int(round(config.get('blackbox_post_trigger', 10) / sampling))
+        self._max_captures = config.get('blackbox_max_captures', 100)
+
+        # the ring holds the pre-trigger samples of a capture when its
+        # post-trigger samples are in
+        self._size = self._pre + self._post
+        self._times = np.zeros(self._size)
+        self._samples = np.zeros((self._size, len(self.fields)))
+        self._head = 0
+        self._count = 0
+
+        # the capture waiting for its post-trigger samples: the sample
+        # count when it is complete, the trigger time and the reasons
+        self._pending = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._queue = Queue()
+        self._writer = Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def add_samples(self, samples, now=None):
+        '''
+        Adds a block of samples to the ring, the last one taken now
+        and the previous ones one sampling_interval apart (moved after
+        the previous block if they would overlap it, see SampleClock),
+        and saves the pending capture if it is complete.
+
+        arguments:
+        - samples: a 2-D block of samples, one row per sample in
+                   get_all_fields order
+        - now: the time of the last sample, default the SampleClock
+               of the black box
+        '''
+
+        if not len(samples):
+            return
+
+        samples = np.asarray(samples)
+        times = self._clock.times(len(samples), now)
+
+        # the capture ends on its last post-trigger sample, even if
+        # the block goes further
+        if self._pending is not None and self._count + len(samples) >= self._pending[0]:
+            split = self._pending[0] - self._count
+            self._append(times[:split], samples[:split])
+            self._save()
+            times, samples = times[split:], samples[split:]
+        self._append(times, samples)
+
+    def _append(self, times, samples):
+        '''
+        Copies samples and their times into the ring
+        '''
+
+        self._count += len(samples)
+        times, samples = times[-self._size:], samples[-self._size:]
+        n = len(samples)
+
+        first = min(n, self._size - self._head)
+        self._times[self._head:self._head + first] = times[:first]
+        self._samples[self._head:self._head + first] = samples[:first]
+        self._times[:n - first] = times[first:]
+        self._samples[:n - first] = samples[first:]
+        self._head = (self._head + n) % self._size
+
+    def trigger(self, reason, now=None):
+        '''
+        Starts a capture, or adds a reason to the pending one
+
+        arguments:
+        - reason: why, e.g. the alarm message
+        - now: the time of the trigger, default time.time()
+        '''
+
+        if now is None:
+            now = time.time()
+        if self._pending is None:
+            print('NORMAL: Black box capture triggered by', reason)
+            self._pending = (self._count + self._post, now, [reason])
+        else:
+            self._pending[2].append(reason)
+
+    def connect_journal(self, journal):
+        '''
+        Triggers a capture on every alarm added to a Journal
+        '''
+        def added(row):
+            if journal.kind(row) == 'alarm':
+                self.trigger(journal.entry(row).text, journal.time(row))
+        journal.subscribe(added)
+
+    def _save(self):
+        '''
+        Hands the samples of the pending capture to the writer thread
+        '''
+
+        _, trigger, reasons = self._pending
+        self._pending = None
+
+        n = min(self._count, self._size)
+        order = np.arange(self._head - n, self._head) % self._size
+        self._queue.put((trigger, reasons, self._times[order], self._samples[order]))
+
+    def _write_loop(self):
+        '''
+        The body of the writer thread
+        '''
+
+        while True:
+            capture = self._queue.get()
+            if capture is None:
+                return
+            trigger, reasons, times, samples = capture
+
+            name = time.strftime('blackbox_%Y%m%d_%H%M%S', time.localtime(trigger))
+            name += '_%03d.npz' % (trigger % 1 * 1000)
+            path = os.path.join(self.path, name)
+            try:
+                np.savez_compressed(path, times=times, samples=samples,
+                                    fields=np.array(self.fields), trigger=trigger,
+                                    reasons=np.array(reasons))
+                print('NORMAL: Black box capture saved to', path)
+
+                captures = sorted(glob.glob(os.path.join(self.path, 'blackbox_*.npz')))
+                for old in captures[:max(len(captures) - self._max_captures, 0)]:
+                    os.remove(old)
+            except OSError as error:
+                print('ERROR: Black box capture not saved:', error)
+
+    def close(self):
+        '''
+        Saves the pending capture, with the post-trigger samples
+        received so far, and stops the writer thread
+        '''
+
+        if self._pending is not None:
+            self._save()
+        self._queue.put(None)
+        self._writer.join()
@@ -0,0 +1,184 @@
+'''
+Splits the pressure and flow samples into breaths, and computes the
+metrics of each breath.
+'''
+
+import time
+from collections import namedtuple
+import numpy as np
+
+
+# The metrics of a breath, from the start of an inspiration to the
+# start of the next one:
+# - time: the end of the breath, in seconds since the epoch
+# - ti, te: the inspiration and expiration times, in seconds
+# - ie_ratio: ti / te
+# - rate: the breaths per minute, at this breath duration
+# - pip: the peak inspiratory pressure
+# - plateau: the mean pressure at the end of the inspiration
+# - peep: the mean pressure at the end of the expiration
+# - tidal_volume, expired_volume: the flow integrated over the
+#   inspiration and the expiration, in ml
+Breath = namedtuple('Breath', ['time', 'ti', 'te', 'ie_ratio', 'rate',
+                               'pip', 'plateau', 'peep',
+                               'tidal_volume', 'expired_volume'])
+
+
+class BreathAnalyzer():
+    '''
+    Finds the inspiration and expiration boundaries in the pressure
+    as the samples come:
+    - an inspiration starts when the pressure rises by
+      breath_trigger_pressure above its minimum since the expiration
+      started
+    - an expiration starts when the pressure falls below the middle
+      of that minimum and the peak of the inspiration.
+
+    The samples of the current breath are buffered; when the next
+    inspiration starts, the metrics are computed at once on the whole
+    breath and passed to the subscribers as a Breath.
+
+    Example usage:
+
+    ```
+    analyzer.subscribe(lambda breath: print(breath.peep))
+    ```
+    '''
+
+    INSPIRATION = 0
+    EXPIRATION = 1
+
+    def __init__(self, config):
+        '''
+        Constructor
+
+        arguments:
+        - config: the config dictionary
+        '''
+
+        fields = config['get_all_fields']
+        self._pressure = fields.index('pressure')
+        self._flow = fields.index('flow')
+        self._sampling = config['sampling_interval']
+
+        self._trigger = config.get('breath_trigger_pressure', 5.)
+        self._min_phase = config.get('breath_min_phase', 0.2) / self._sampling
+        self._max_samples = int(config.get('breath_max_duration', 20.) / self._sampling)
+        self._plateau = max(int(config.get('breath_plateau_window', 0.2) / self._sampling), 1)
+        self._peep = max(int(config.get('breath_peep_window', 0.3) / self._sampling), 1)
+
+        self._subscribers = []
+        self.last = None
+        self._reset()
+
+    def _reset(self):
+        '''
+        Waits for the next inspiration, discarding the current breath
+        '''
+
+        self._phase = self.EXPIRATION
+        self._chunks = []
+        self._length = 0
+        self._started = False
+        self._split = 0
+        self._phase_start = 0
+        self._low = np.inf
+        self._high = -np.inf
+
+    def subscribe(self, callback):
+        '''
+        Registers a function called with each completed Breath
+
+        arguments:
+        - callback: the function, called in the acquisition thread
+        '''
+        self._subscribers.append(callback)
+
+    def add_samples(self, samples, now=None):
+        '''
+        Adds a block of samples, the last one taken now
+
+        arguments:
+        - samples: a 2-D block of samples, one row per sample in
+                   get_all_fields order (after the conversions)
+        - now: the time of the last sample, default time.time()
+        '''
+
+        if not len(samples):
+            return
+        if now is None:
+            now = time.time()
+
+        block = samples[:, [self._pressure, self._flow]]
+        first = self._length
+        self._chunks.append(block)
+        self._length += len(block)
+
+        # the indexes are in the buffered samples, which are dropped
+        # up to the start of each new breath
+        shift = 0
+        for i, pressure in enumerate(block[:, 0].tolist(), first):
+            i -= shift
+            if self._phase == self.EXPIRATION:
+                self._low = min(self._low, pressure)
+                if (pressure > self._low + self._trigger and
+                        i - self._phase_start >= self._min_phase):
+                    self._complete(i, now - self._sampling * (self._length - 1 - i))
+                    shift += i
+                    i = 0
+                    self._started = True
+                    self._phase = self.INSPIRATION
+                    self._phase_start = i
+                    self._high = pressure
+            else:
+                self._high = max(self._high, pressure)
+                if (pressure < (self._low + self._high) / 2 and
+                        i - self._phase_start >= self._min_phase):
+                    self._phase = self.EXPIRATION
+                    self._phase_start = i
+                    self._split = i
+                    self._low = pressure
+
+        if self._length > self._max_samples:
+            # no breath for a long time, e.g. the ventilator is stopped
+            self._reset()
+
+    def _complete(self, end, end_time):
+        '''
+        Computes the metrics of the breath ending before the sample
+        at index end, if a whole breath was buffered, and keeps the
+        following samples for the next breath.
+        '''
+
+        data = np.concatenate(self._chunks)
+        self._chunks = [data[end:]]
+        self._length = len(data) - end
+        if not self._started:
+            return
+
+        pressure = data[:end, 0]
+        flow = data[:end, 1]
+        split = self._split
+        if not 0 < split < end:
+            return
+
+        # slpm integrated over the sampling interval, in ml
+        volume = self._sampling * 1000. / 60.
+        ti = split * self._sampling
+        te = (end - split) * self._sampling
+
+        breath = Breath(
+            time=end_time,
+            ti=ti,
+            te=te,
+            ie_ratio=ti / te,
+            rate=60. / (ti + te),
+            pip=pressure[:split].max(),
+            plateau=pressure[max(split - self._plateau, 0):split].mean(),
+            peep=pressure[max(end - self._peep, split):end].mean(),
+            tidal_volume=np.clip(flow[:split], 0, None).sum() * volume,
+            expired_volume=np.clip(-flow[split:], 0, None).sum() * volume)
+
+        self.last = breath
+        for callback in self._subscribers:
+            callback(breath)
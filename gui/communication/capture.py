@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Records the bytes exchanged with the ESP32 into a capture file, and
+replays them later through the same decoding path.
+
+A capture file starts with CAPTURE_MAGIC, followed by one record per
+read or write:
+
+    time (float64) | direction (b'r' or b'w') | length (uint32) | bytes
+
+all little-endian, the time in seconds since the start of the capture
+(monotonic clock).
+
+Usage, from the gui directory:
+
+```
+python -m communication.capture <capture file>     # prints a summary
+```
+"""
+
+import time
+import struct
+import argparse
+from threading import Lock, Condition
+
+__all__ = ("CaptureConnection", "ReplayConnection", "read_capture")
+
+
+CAPTURE_MAGIC = b'MVMCAP1\n'
+_RECORD = struct.Struct('<dcI')
+
+# a capture file is flushed to disk at least this often, in seconds
+_FLUSH_INTERVAL = 1.
+
+
+def read_capture(path):
+    """
+    Reads a capture file
+
+    arguments:
+    - path           the capture file
+
+    returns: a generator of (time, direction, bytes) tuples, direction
+    being b'r' for the bytes read and b'w' for the bytes written.
+    """
+
+    with open(path, 'rb') as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+
+        while True:
+            header = capture.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                # a truncated record is the end of an interrupted capture
+                return
+            timestamp, direction, length = _RECORD.unpack(header)
+            data = capture.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, direction, data
+
+
+class CaptureConnection:
+    """
+    Wraps a serial.Serial instance and appends every byte read or
+    written to a capture file.
+    """
+
+    def __init__(self, connection, path):
+        """
+        Contructor
+
+        arguments:
+        - connection     the serial.Serial instance to wrap
+        - path           the capture file, overwritten if it exists
+        """
+
+        self._connection = connection
+        self._path = path
+        self._file = open(path, 'wb')
+        self._file.write(CAPTURE_MAGIC)
+        self._lock = Lock()
+        self._start = time.monotonic()
+        self._flushed = self._start
+
+    def _record(self, direction, data):
+        """
+        Appends a record to the capture file
+        """
+
+        if not data:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_RECORD.pack(now - self._start, direction, len(data)))
+            self._file.write(data)
+            if now - self._flushed > _FLUSH_INTERVAL:
+                self._file.flush()
+                self._flushed = now
+
+    def read(self, size=1):
+        data = self._connection.read(size)
+        self._record(b'r', data)
+        return data
+
+    def write(self, data):
+        self._record(b'w', data)
+        return self._connection.write(data)
+
+    def open(self):
+        """
+        Reopens the wrapped connection, e.g. after an error, and
+        goes on appending to the capture file
+        """
+
+        with self._lock:
+            if self._file.closed:
+                self._file = open(self._path, 'ab')
+        self._connection.open()
+
+    def close(self):
+        """
+        Closes the wrapped connection and the capture file. Can be
+        called more than once.
+        """
+
+        with self._lock:
+            self._file.close()
+        self._connection.close()
+
+    def __getattr__(self, name):
+        # everything else (in_waiting, fileno, port, ...) is the
+        # wrapped connection's
+        return getattr(self._connection, name)
+
+
+class ReplayConnection:
+    """
+    Plays a capture file back, in place of a serial.Serial instance:
+    the bytes read during the capture become available at the same
+    times, scaled by the speed. What is written is discarded.
+
+    Example usage:
+
+    ```
+    esp32 = ESP32Serial(config, connection=ReplayConnection("bedside.cap"))
+    ```
+    """
+
+    port = "replay"
+
+    def __init__(self, path, speed=1., lockstep=True, timeout=0.01):
+        """
+        Contructor
+
+        arguments:
+        - path           the capture file
+        - speed          the replay speed, e.g. 2 for twice as fast as
+                         the capture; None for as fast as possible
+        - lockstep       if True (default), the bytes read after a
+                         write during the capture only become available
+                         once as many writes are replayed, so that the
+                         replies never come before their requests
+        - timeout        the read() timeout in seconds
+        """
+
+        self.speed = speed
+        self.lockstep = lockstep
+        self.timeout = timeout
+
+        # the reads, each with the number of writes preceding it
+        self._reads = []
+        writes = 0
+        for timestamp, direction, data in read_capture(path):
+            if direction == b'w':
+                writes += 1
+            else:
+                self._reads.append((timestamp, writes, data))
+
+        self.writes = 0
+        self._next = 0
+        self._pending = bytearray()
+        self._condition = Condition()
+        self._start = time.monotonic()
+
+    def _elapsed(self):
+        """
+        returns: the capture time reached by the replay
+        """
+
+        if self.speed is None:
+            return float('inf')
+        return (time.monotonic() - self._start) * self.speed
+
+    def _release(self):
+        """
+        Moves the reads that are due to the pending bytes
+
+        returns: the time in seconds until the next read is due, None
+        if it is waiting for a write or if the capture is over
+        """
+
+        elapsed = self._elapsed()
+        while self._next < len(self._reads):
+            timestamp, writes, data = self._reads[self._next]
+            if self.lockstep and writes > self.writes:
+                return None
+            if timestamp > elapsed:
+                return (timestamp - elapsed) / self.speed
+            self._pending += data
+            self._next += 1
+        return None
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            self._release()
+            return len(self._pending)
+
+    @property
+    def finished(self):
+        """
+        True when all the capture was read
+        """
+
+        with self._condition:
+            return self._next == len(self._reads) and not self._pending
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                due = self._release()
+                if self._pending:
+                    data = bytes(self._pending[:size])
+                    del self._pending[:size]
+                    return data
+
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return b""
+                self._condition.wait(left if due is None else min(left, due))
+
+    def write(self, data):
+        with self._condition:
+            self.writes += 1
+            self._condition.notify_all()
+        return len(data)
+
+    def reset_input_buffer(self):
+        # the bytes discarded during the capture were never recorded
+        pass
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarizes a capture file")
+    parser.add_argument("capture", help="the capture file")
+    args = parser.parse_args()
+
+    counts = {b'r': [0, 0], b'w': [0, 0]}
+    duration = 0.
+    for timestamp, direction, data in read_capture(args.capture):
+        counts[direction][0] += 1
+        counts[direction][1] += len(data)
+        duration = timestamp
+
+    print("duration: %.3f s" % duration)
+    for direction, name in ((b'w', "written"), (b'r', "read")):
+        records, size = counts[direction]
+        print("%-8s %8d records %10d bytes %10.1f bytes/s" %
+              (name, records, size, size / duration if duration else 0.))
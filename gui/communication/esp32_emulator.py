@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+A headless ESP32 emulator speaking the serial protocol of mock/mock.ino
+on a Linux pseudo-terminal, so that ESP32Serial can be exercised (and
+benchmarked) without hardware.
+
+Usage, from the gui directory:
+
+```
+python -m communication.esp32_emulator                 # serves the pty
+python -m communication.esp32_emulator --benchmark 1000
+```
+"""
+
+import os
+import sys
+import tty
+import time
+import random
+import struct
+import zlib
+import argparse
+from threading import Thread, Lock
+import yaml
+
+from communication.peep import peep
+from communication.esp32serial import FRAME_MAGIC
+
+__all__ = ("ESP32Emulator",)
+
+
+class ESP32Emulator:
+    """
+    Answers get, set and stream commands on a pseudo-terminal, the
+    same way mock/mock.ino does. Pressure and flow follow the peep
+    waveforms, the other measures are random.
+
+    Example usage:
+
+    ```
+    emulator = ESP32Emulator(config)
+    emulator.start()
+    esp32 = ESP32Serial(dict(config, port=emulator.port))
+    ```
+    """
+
+    # measures reported as random values, with the mock.ino ranges
+    random_measures = {
+        "bpm": (6, 8),
+        "o2": (30, 100),
+        "tidal": (1000, 1500),
+        "peep": (4, 20),
+        "temperature": (10, 50),
+        "power_mode": (0, 1),
+        "battery": (20, 100),
+        "battery_powered": (0, 1),
+        "battery_charge": (20, 100),
+        "peak": (70, 80),
+        "total_inspired_volume": (1000, 2000),
+        "total_expired_volume": (1000, 2000),
+        "volume_minute": (10, 100),
+    }
+
+    protocol = "frame,stream,pipeline,many,alarm_events"
+
+    def __init__(self, config, latency=0., baudrate=None):
+        """
+        Contructor
+
+        Opens the pseudo-terminal.
+
+        arguments:
+        - config         the configuration object containing at least the
+                         "get_all_fields" key
+        - latency        time in seconds the emulator waits before
+                         replying to a command
+        - baudrate       if given, the replies are paced as on a serial
+                         line at this speed
+        """
+
+        self.get_all_fields = config["get_all_fields"]
+        self.latency = latency
+        self.baudrate = baudrate
+
+        self.parameters = {
+            "alarm": "0",
+            "warning": "0",
+            "run": "0",
+            "mode": "0",
+            "backup": "0",
+            "rate": "12",
+            "ratio": "2",
+            "ptarget": "15",
+            "assist_ptrigger": "1",
+            "assist_flow_min": "20",
+            "pressure_support": "10",
+            "backup_enable": "1",
+            "backup_min_rate": "10",
+            "pause_lg_time": "10",
+            "protocol": self.protocol,
+        }
+        self.watchdog_resets = 0
+        self.commands = 0
+
+        self._peep = peep()
+        self._pause_lg_expiration = time.time() + 10
+        self._stream_period = None
+        self._stream_frames = False
+        self._running = False
+        self._threads = []
+        self._write_lock = Lock()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+    def start(self):
+        """
+        Starts serving the pseudo-terminal in background threads
+        """
+
+        self._running = True
+        self._threads = [Thread(target=self.serve, daemon=True),
+                         Thread(target=self._stream_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops serving and closes the pseudo-terminal
+        """
+
+        self._running = False
+        os.close(self._slave)
+        os.close(self._master)
+
+    def serve(self):
+        """
+        Reads the commands and replies, until stop() is called
+        """
+
+        buffer = b""
+        while self._running:
+            try:
+                buffer += os.read(self._master, 4096)
+            except OSError:
+                return
+
+            # commands end with '\r' as in mock.ino, the '\n' following
+            # it is trimmed with the next command
+            *commands, buffer = buffer.split(b'\r')
+            for command in commands:
+                self._handle(command.strip().decode())
+
+    def _write(self, data):
+        """
+        Writes a reply, paced at the baudrate if given
+        """
+
+        with self._write_lock:
+            if self.baudrate:
+                time.sleep(len(data) * 10 / self.baudrate)
+            os.write(self._master, data)
+
+    def _handle(self, command):
+        """
+        Executes a command and sends the reply
+
+        arguments:
+        - command        the command line, without terminator
+        """
+
+        if not command:
+            return
+
+        self.commands += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        # pipelined commands are prefixed by "#<tag> ", echoed in the reply
+        tag = ""
+        if command.startswith("#"):
+            tag, _, command = command.partition(" ")
+            tag += " "
+
+        words = command.split(" ")
+        if command == "get all_frame":
+            self._write(self._frame())
+            return
+
+        if words[0] == "get" and len(words) > 1:
+            reply = ",".join(self._get_value(name) for name in words[1].split(","))
+        elif words[0] == "set" and len(words) > 2:
+            reply = self._set(words[1], words[2])
+        elif words[0] == "stream" and len(words) > 1:
+            reply = self._stream(words[1:])
+        else:
+            reply = "notok"
+
+        self._write((tag + "valore=" + reply + "\r\n").encode())
+
+    def _get_value(self, name):
+        """
+        returns: the value of a parameter or measure, as a string
+        """
+
+        if name == "all":
+            return ",".join(str(value) for value in self._all_values())
+        if name == "pause_lg_time":
+            return str(max(int(self._pause_lg_expiration - time.time()), 0))
+        if name == "pressure":
+            return str(self._peep.pressure())
+        if name == "flow":
+            return str(self._peep.flow())
+        if name in self.random_measures:
+            return str(random.randint(*self.random_measures[name]))
+        return self.parameters.get(name, "unknown")
+
+    def _set(self, name, value):
+        """
+        Sets a parameter
+
+        returns: "OK"
+        """
+
+        changed = self.parameters.get(name) != value
+        self.parameters[name] = value
+
+        if name in ("alarm", "warning") and changed:
+            self._alarm_event()
+        elif name == "watchdog_reset":
+            self.watchdog_resets += 1
+        elif name == "pause_lg" and value == "1":
+            self._pause_lg_expiration = time.time() + int(self.parameters["pause_lg_time"])
+
+        return "OK"
+
+    def _alarm_event(self):
+        """
+        Reports the alarm and warning bitmasks, while streaming
+        """
+
+        if self._stream_period is not None:
+            self._write(("alarm=%s,%s\r\n" % (self.parameters["alarm"],
+                                                self.parameters["warning"])).encode())
+
+    def _stream(self, args):
+        """
+        "stream on <period ms> [frame]" or "stream off"
+
+        returns: "OK", or "notok" if the arguments are not understood
+        """
+
+        if args[0] == "on":
+            period = int(args[1]) if len(args) > 1 and args[1].isdigit() else 0
+            self._stream_frames = args[-1] == "frame"
+            self._stream_period = (period if period > 0 else 100) / 1000
+        elif args[0] == "off":
+            self._stream_period = None
+        else:
+            return "notok"
+
+        return "OK"
+
+    def _all_values(self):
+        """
+        returns: the measures as floats, in get_all_fields order; 0 for
+        the unknown ones
+        """
+
+        values = [self._get_value(name) for name in self.get_all_fields]
+        return [0. if value == "unknown" else float(value) for value in values]
+
+    def _frame(self):
+        """
+        returns: the binary version of "get all"
+        """
+
+        payload = struct.pack('<%df' % len(self.get_all_fields), *self._all_values())
+        return (FRAME_MAGIC + struct.pack('<H', len(payload)) + payload +
+                struct.pack('<I', zlib.crc32(payload)))
+
+    def _stream_loop(self):
+        """
+        Pushes the telemetry while streaming is on
+        """
+
+        last = time.monotonic()
+        while self._running:
+            period = self._stream_period
+            if period is None:
+                time.sleep(0.01)
+                last = time.monotonic()
+                continue
+
+            last += period
+            time.sleep(max(last - time.monotonic(), 0))
+            try:
+                if self._stream_frames:
+                    self._write(self._frame())
+                else:
+                    values = ",".join(str(value) for value in self._all_values())
+                    self._write(("stream=" + values + "\r\n").encode())
+            except OSError:
+                return
+
+
+def benchmark(config, requests, latency, baudrate):
+    """
+    Measures ESP32Serial against the emulator and prints the results
+
+    arguments:
+    - config         the configuration object
+    - requests       number of requests of each type
+    - latency        the emulator reply latency in seconds
+    - baudrate       the emulated line speed, None for no limit
+    """
+
+    from communication.esp32serial import ESP32Serial
+
+    emulator = ESP32Emulator(config, latency, baudrate)
+    emulator.start()
+    esp32 = ESP32Serial(dict(config, port=emulator.port))
+    print("Protocol:", ",".join(sorted(esp32.protocol)),
+          "binary frames:", esp32.binary_frames)
+
+    tests = [("get_all_values", esp32.get_all_values),
+             ("get_many", lambda: esp32.get_many(["run", "mode", "backup"], kind="status")),
+             ("set_watchdog", esp32.set_watchdog)]
+
+    for name, fn in tests:
+        start = time.monotonic()
+        for _ in range(requests):
+            fn()
+        elapsed = time.monotonic() - start
+        print("%-16s %8.1f requests/s %8.3f ms/request" %
+              (name, requests / elapsed, 1000 * elapsed / requests))
+
+    esp32.start_streaming(config["sampling_interval"])
+    time.sleep(1)
+    samples = esp32.drain_stream()
+    esp32.stop_streaming()
+    print("%-16s %8d samples/s" % ("stream", len(samples)))
+
+    for kind, stats in esp32.latency_histogram().items():
+        print(kind, {key: stats[key] for key in ("count", "timeouts", "errors", "skipped")})
+        print("   <= ms:", " ".join("%6g" % (1000 * edge) for edge in stats["bins"]), "  more")
+        print("   count:", " ".join("%6d" % count for count in stats["histogram"]))
+
+    emulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(__file__),
+                                                         os.pardir, "default_settings.yaml"),
+                        help="the GUI configuration file")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="run N requests of each type through ESP32Serial and exit")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="reply latency in seconds")
+    parser.add_argument("--baudrate", type=int,
+                        help="emulated line speed, unlimited by default")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    if args.benchmark:
+        benchmark(config, args.benchmark, args.latency, args.baudrate)
+        sys.exit(0)
+
+    emulator = ESP32Emulator(config, args.latency, args.baudrate)
+    print("Emulating the ESP32 on", emulator.port)
+    emulator._running = True
+    Thread(target=emulator._stream_loop, daemon=True).start()
+    try:
+        emulator.serve()
+    except KeyboardInterrupt:
+        pass
@@ -1,6 +1,12 @@
+from functools import lru_cache
+
+
 class ESP32BaseAlarm:
     '''
     The base ESP Alarm Class
+
+    The bits and the messages of a number are decoded once per class
+    and number, the same numbers being received over and over.
     '''
 
     alarm_to_string = {
@@ -22,15 +28,27 @@ class ESP32BaseAlarm:
     def __str__(self):
         return 'All alarms: ' + ' - '.join(self.strerror_all())
 
-    def unpack(self):
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _decode(cls, number):
         '''
-        Unpacks the number obtained from the ESP
+        Decodes a number obtained from the ESP
+
+        returns: the set bits, their messages, and their messages
+        with the codes, as tuples
         '''
 
-        self.alarms = list(filter(lambda x: x, [ self.number & (1<<test) for test in range(32)]))
+        alarms = tuple(1 << bit for bit in range(32) if number >> bit & 1)
+        messages = tuple(cls.alarm_to_string.get(n, 'Unknown error') for n in alarms)
+        with_codes = tuple('%s (code: %d)' % (m, n) for m, n in zip(messages, alarms))
+        return alarms, messages, with_codes
 
-        print('Found alarms', self.alarms)
+    def unpack(self):
+        '''
+        Unpacks the number obtained from the ESP
+        '''
 
+        self.alarms = list(self._decode(self.number)[0])
         return self.alarms
 
 
@@ -58,22 +76,8 @@ class ESP32BaseAlarm:
         arguments:
         - append_err_no: if True, also adds the err number
         '''
-        if not hasattr(self, 'alarms'):
-            self.unpack()
-
-        str_error = []
-        for n in self.alarms:
-
-            s = self.strerror(n)
-
-            if append_err_no:
-                s += ' (code: '
-                s += str(n)
-                s += ')'
-
-            str_error.append(s)
-
-        return str_error
+        _, messages, with_codes = self._decode(self.number)
+        return list(with_codes if append_err_no else messages)
 
 
 
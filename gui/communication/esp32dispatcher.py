@@ -0,0 +1,180 @@
+"""
+A serial I/O thread owning all the accesses to the ESP32
+"""
+
+import itertools
+import time
+import traceback
+from concurrent.futures import Future
+from queue import PriorityQueue
+from threading import Thread, Lock
+from PyQt5.QtCore import QObject, pyqtSignal
+
+__all__ = ("ESP32Dispatcher",)
+
+
+class _Bridge(QObject):
+    """
+    Runs the request callbacks in the thread this object lives in,
+    i.e. the GUI thread.
+    """
+
+    done = pyqtSignal(object, object)
+
+    def __init__(self):
+        super(_Bridge, self).__init__()
+        self.done.connect(self._call)
+
+    def _call(self, fn, arg):
+        fn(arg)
+
+
+class ESP32Dispatcher:
+    """
+    Executes the ESP32 requests on a dedicated thread, in priority
+    order, so that the GUI thread never waits for the serial line.
+
+    Example usage:
+
+    ```
+    dispatcher.submit(dispatcher.PRIORITY_ALARM, esp32.get_alarms,
+                      callback=show_alarms, errback=show_error)
+    ```
+
+    The callbacks are executed in the GUI thread.
+    """
+
+    PRIORITY_WATCHDOG = 0
+    PRIORITY_ALARM = 1
+    PRIORITY_TELEMETRY = 2
+    PRIORITY_SETTINGS = 3
+
+    priority_names = {
+        PRIORITY_WATCHDOG: "watchdog",
+        PRIORITY_ALARM: "alarm",
+        PRIORITY_TELEMETRY: "telemetry",
+        PRIORITY_SETTINGS: "settings",
+    }
+
+    def __init__(self, esp32, threaded=True):
+        """
+        Contructor
+
+        arguments:
+        - esp32          the ESP32Serial (or FakeESP32Serial) instance
+        - threaded       if False, the requests are executed right away
+                         in the calling thread (e.g. for the
+                         FakeESP32Serial, which is a Qt widget itself)
+        """
+
+        self.esp32 = esp32
+        self._threaded = threaded
+        self._queue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._bridge = _Bridge()
+
+        self._stats_lock = Lock()
+        self._wait_stats = {p: [0, 0., 0.] for p in self.priority_names}
+
+        self._thread = None
+        if self._threaded:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, priority, fn, *args, callback=None, errback=None):
+        """
+        Queues a request for the serial thread
+
+        arguments:
+        - priority       one of the PRIORITY_* constants, lower first
+        - fn             the function to call, usually an ESP32Serial
+                         method
+        - args           the arguments to pass to fn
+
+        named arguments:
+        - callback       called in the GUI thread with the result of fn
+        - errback        called in the GUI thread with the exception
+                         raised by fn
+
+        returns: a concurrent.futures.Future for the result of fn
+        """
+
+        future = Future()
+        request = (fn, args, future, callback, errback, time.monotonic())
+
+        if self._threaded:
+            self._queue.put((priority, next(self._sequence), request))
+        else:
+            self._execute(priority, request, lambda cb, arg: cb(arg))
+
+        return future
+
+    def stop(self):
+        """
+        Stops the serial thread once the pending requests are done
+        """
+
+        if self._thread is not None:
+            self._queue.put((len(self.priority_names), next(self._sequence), None))
+            self._thread.join()
+            self._thread = None
+
+    def queue_wait_stats(self):
+        """
+        Time spent by the requests in the queue, per priority
+
+        returns: a dict priority name -> dict with the number of
+        requests, the average and the maximum wait in seconds.
+        """
+
+        with self._stats_lock:
+            return {self.priority_names[p]: {"count": n,
+                                             "mean": total / n if n else 0.,
+                                             "max": maximum}
+                    for p, (n, total, maximum) in self._wait_stats.items()}
+
+    def _run(self):
+        """
+        The body of the serial thread
+        """
+
+        while True:
+            priority, _, request = self._queue.get()
+            if request is None:
+                return
+            self._execute(priority, request, self._bridge.done.emit)
+
+    def _execute(self, priority, request, deliver):
+        """
+        Runs a request and delivers its outcome
+
+        arguments:
+        - priority       the request priority
+        - request        the tuple queued by submit()
+        - deliver        how to call a callback with an argument
+        """
+
+        fn, args, future, callback, errback, queued = request
+
+        wait = time.monotonic() - queued
+        with self._stats_lock:
+            stats = self._wait_stats.setdefault(priority, [0, 0., 0.])
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] = max(stats[2], wait)
+
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = fn(*args)
+        except Exception as error:
+            future.set_exception(error)
+            if errback is not None:
+                deliver(errback, error)
+            else:
+                traceback.print_exc()
+        else:
+            future.set_result(result)
+            if callback is not None:
+                deliver(callback, result)
@@ -2,11 +2,64 @@
 Library to interface with the ESP32
 """
 
-from threading import Lock
+from threading import Lock, Thread
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+from bisect import bisect_left
+import itertools
+import select
+import time
+import struct
+import zlib
+import numpy as np
 import serial # pySerial
 from . import ESP32Alarm, ESP32Warning
 
-__all__ = ("ESP32Serial", "ESP32Exception")
+__all__ = ("ESP32Serial", "ESP32Exception", "ESP32Batch")
+
+
+# Binary telemetry frame, as sent by the ESP in reply to "get all_frame":
+#
+#   magic (2 bytes) | payload length (uint16) | payload | crc32 (uint32)
+#
+# the payload is one little-endian float32 per get_all_fields entry, in
+# the same order; the CRC is computed on the payload only.
+FRAME_MAGIC = b'\xa5\x5a'
+_FRAME_HEADER = struct.Struct('<2sH')
+_FRAME_CRC = struct.Struct('<I')
+
+# Default deadlines in seconds, per request kind: the telemetry is
+# requested again at the next sampling anyway, while the watchdog, the
+# alarms and the status must not be given up too early.
+DEFAULT_DEADLINES = {
+    "telemetry": 0.05,
+    "watchdog": 0.2,
+    "alarm": 0.2,
+    "status": 0.2,
+    "command": 0.5,
+}
+
+# the request kinds that are sent even while the connection backs off
+CRITICAL_KINDS = ("watchdog", "alarm")
+
+# upper edges, in seconds, of the latency histogram bins
+LATENCY_BINS = (0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+
+# streaming mode: longest line accepted, longer ones are garbage
+_MAX_LINE = 4096
+
+# streaming mode: the stream is stalled when no sample came for this
+# many sampling periods
+STALL_PERIODS = 5
+
+_REPLY_PREFIX = b'valore='
+_STREAM_PREFIX = b'stream='
+
+# streaming mode: an ESP advertising the "alarm_events" protocol
+# feature sends 'alarm=<alarm>,<warning>' as soon as either bitmask
+# changes
+_ALARM_PREFIX = b'alarm='
 
 
 class ESP32Exception(Exception):
@@ -32,10 +85,84 @@ class ESP32Exception(Exception):
                 "ERROR in %s: line: '%s'; output: %s" % (verb, line, output))
 
 
+class _Timeout(Exception):
+    """
+    A request deadline expired before the reply was complete.
+    """
+
+
+class ESP32Batch:
+    """
+    Collects get and set commands, and sends them all at once when the
+    with block is left. See ESP32Serial.batch().
+    """
+
+    def __init__(self, esp32, kind="command"):
+        """
+        Contructor
+
+        arguments:
+        - esp32          the ESP32Serial (or FakeESP32Serial) executing
+                         the batch
+        - kind           the request kind, see ESP32Serial deadlines
+        """
+
+        self._esp32 = esp32
+        self._kind = kind
+        self._requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self._requests:
+            self._esp32._run_batch(self._requests, self._kind)
+        return False
+
+    def _add(self, verb, *args):
+        future = Future()
+        self._requests.append((verb, args, future))
+        return future
+
+    def get(self, name):
+        """
+        Queues a get command
+
+        arguments:
+        - name           the parameter name as a string
+
+        returns: a Future for the requested value, available after the
+        with block.
+        """
+
+        return self._add("get", name)
+
+    def set(self, name, value):
+        """
+        Queues a set command
+
+        arguments:
+        - name           the parameter name as a string
+        - value          the value to assign to the variable as any type
+                         convertible to string
+
+        returns: a Future for the reply ("OK" in case of success),
+        available after the with block.
+        """
+
+        return self._add("set", name, value)
+
 
 class ESP32Serial:
     """
     Main class for interfacing with the ESP32 via a serial connection.
+
+    Every request has a deadline depending on its kind (see the
+    "serial_deadlines" configuration key): if the reply does not arrive
+    in time, the request fails with an ESP32Exception instead of
+    retrying. After a failure the connection backs off exponentially:
+    in the meanwhile only the watchdog and alarm requests reach the ESP,
+    the others fail right away.
     """
 
     def __init__(self, config, **kwargs):
@@ -53,23 +180,76 @@ class ESP32Serial:
         - baudrate       the preferred baudrate, default 115200
         - terminator     the line terminator, binary encoded, default
                          b'\n'
-        - timeout        sets the read() timeout in seconds
+        - timeout        the read() polling interval in seconds, default
+                         0.01. The requests have their own deadlines.
+        - connection     an already open connection to use instead of
+                         the serial port, e.g. a ReplayConnection
+
+        If the configuration sets "capture_file", all the bytes read
+        and written are recorded there (see CaptureConnection).
+
+        If the configuration enables "use_binary_frames" and the ESP
+        advertises the "frame" protocol feature, the get_all values are
+        transferred as binary frames, otherwise the ASCII protocol is
+        used.
         """
 
         self.lock = Lock()
-
-        baudrate = kwargs["baudrate"] if "baudrate" in kwargs else 115200
-        timeout = kwargs["timeout"] if "timeout" in kwargs else 1
-        self.term = kwargs["terminator"] if "terminator" in kwargs else b'\n'
-        self.connection = serial.Serial(port=config["port"],
-                                        baudrate=baudrate, timeout=timeout,
-                                        **kwargs)
+        self._tags = itertools.count(1)
+        self.protocol = set()
+
+        # streaming mode: a reader thread splits the incoming bytes into
+        # telemetry samples and command replies
+        self.streaming = False
+        self._reader = None
+        self._reader_error = None
+        self._stream_period = None
+        self._last_sample = time.monotonic()
+        self._replies = Queue()
+        self._stream_buffer = deque(maxlen=config.get("stream_buffer_size", 1000))
+        self._alarm_callback = None
+
+        # per request kind deadlines and statistics
+        self.deadlines = dict(DEFAULT_DEADLINES)
+        self.deadlines.update(config.get("serial_deadlines", {}))
+        self._stats = {}
+        self._stats_lock = Lock()
+
+        # connection level backoff
+        self._backoff_min = config.get("serial_backoff_min", 0.1)
+        self._backoff_max = config.get("serial_backoff_max", 5)
+        self._backoff = 0.
+        self._retry_at = 0.
+        self._last_reply = time.monotonic()
+        self._reopen = False
+
+        baudrate = kwargs.pop("baudrate", 115200)
+        timeout = kwargs.pop("timeout", 0.01)
+        self.term = kwargs.pop("terminator", b'\n')
+        # everything received and not parsed yet
+        self._rx = bytearray()
+        self._rx_lock = Lock()
+        self.connection = kwargs.pop("connection", None)
+        if self.connection is None:
+            self.connection = serial.Serial(port=config["port"],
+                                            baudrate=baudrate, timeout=timeout,
+                                            **kwargs)
+        if config.get("capture_file"):
+            from .capture import CaptureConnection
+            self.connection = CaptureConnection(self.connection,
+                                                config["capture_file"])
 
         self.get_all_fields = config["get_all_fields"]
+        self._frame_size = 4 * len(self.get_all_fields)
+        self._frame_total = _FRAME_HEADER.size + self._frame_size + _FRAME_CRC.size
 
         while self.connection.read():
             pass
 
+        self.protocol = self._negotiate()
+        self.binary_frames = (config.get("use_binary_frames", False) and
+                              "frame" in self.protocol)
+
     def __del__(self):
         """
         Destructor.
@@ -77,10 +257,647 @@ class ESP32Serial:
         Closes the connection.
         """
 
+        self.close()
+
+    def close(self):
+        """
+        Stops the reader thread and closes the connection, and the
+        capture file if any. Can be called more than once.
+        """
+
+        self.streaming = False
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+
         with self.lock:
             if hasattr(self, "connection"):
                 self.connection.close()
 
+    def _negotiate(self):
+        """
+        Asks the ESP which protocol extensions it supports.
+
+        returns: a set of feature names, empty if the firmware only
+        speaks the plain ASCII protocol.
+        """
+
+        try:
+            features = self.get("protocol")
+        except ESP32Exception:
+            return set()
+
+        if features == "unknown":
+            return set()
+        return set(features.split(','))
+
+    def latency_histogram(self):
+        """
+        The request latencies and failures, per request kind
+
+        returns: a dict kind -> dict with:
+        - bins           the upper edges of the histogram bins, in
+                         seconds; the last bin collects the slower
+                         requests
+        - histogram      the number of successful requests per bin
+        - count          the number of successful requests
+        - timeouts       the number of requests that missed the deadline
+        - errors         the number of requests that failed otherwise
+        - skipped        the number of requests refused while backing off
+        """
+
+        with self._stats_lock:
+            return {kind: dict(stats, histogram=list(stats["histogram"]),
+                               bins=LATENCY_BINS)
+                    for kind, stats in self._stats.items()}
+
+    def link_down_for(self):
+        """
+        returns: for how long, in seconds, the ESP has not been
+        answering; 0 if the last request succeeded. While streaming,
+        a stalled stream counts as well (see stream_stalled_for()).
+        """
+
+        down = self.stream_stalled_for()
+        if not self._backoff and self._reader_error is None:
+            return down
+        return max(down, time.monotonic() - self._last_reply)
+
+    def stream_stalled_for(self):
+        """
+        returns: for how long, in seconds, no sample has been received
+        while streaming, if it is more than STALL_PERIODS sampling
+        periods (e.g. the ESP was reset and forgot "stream on"); 0
+        otherwise.
+        """
+
+        if not self.streaming:
+            return 0.
+        silent = time.monotonic() - self._last_sample
+        return silent if silent > STALL_PERIODS * self._stream_period else 0.
+
+    def _account(self, kind, outcome):
+        """
+        Updates the statistics of a request kind
+
+        arguments:
+        - kind           the request kind
+        - outcome        the latency in seconds for a successful request,
+                         otherwise one of "timeouts", "errors", "skipped"
+        """
+
+        with self._stats_lock:
+            stats = self._stats.get(kind)
+            if stats is None:
+                stats = self._stats[kind] = {
+                    "count": 0, "timeouts": 0, "errors": 0, "skipped": 0,
+                    "histogram": [0] * (len(LATENCY_BINS) + 1)}
+
+            if isinstance(outcome, str):
+                stats[outcome] += 1
+            else:
+                stats["count"] += 1
+                stats["histogram"][bisect_left(LATENCY_BINS, outcome)] += 1
+
+    def _flush(self):
+        """
+        Drops whatever has been received and not read yet, to resync
+        with the ESP after a protocol error.
+        """
+
+        if self.streaming:
+            # the receive buffer belongs to the reader thread
+            while not self._replies.empty():
+                self._replies.get_nowait()
+        else:
+            self._rx.clear()
+            self.connection.reset_input_buffer()
+
+    def _reopen_connection(self):
+        """
+        Closes and reopens the serial port, e.g. after the USB adapter
+        was unplugged.
+        """
+
+        print("ESP32Serial-DEBUG: reopening %s" % self.connection.port)
+        self.connection.close()
+        self.connection.open()
+        self._reopen = False
+
+    def _transact(self, kind, line, read):
+        """
+        Sends a request and reads its reply within the deadline of the
+        request kind. In case of a protocol error the input is flushed
+        and the request sent again, as long as the deadline allows it.
+
+        arguments:
+        - kind           the request kind, a key of the deadlines dict
+        - line           the request, as a binary buffer
+        - read           the function reading and parsing the reply,
+                         called with the deadline (time.monotonic() based)
+
+        returns: whatever read returns
+        """
+
+        start = time.monotonic()
+        deadline = start + self.deadlines.get(kind, self.deadlines["command"])
+
+        if kind not in CRITICAL_KINDS and start < self._retry_at:
+            self._account(kind, "skipped")
+            raise ESP32Exception(kind, line.decode(),
+                                 "no reply from the ESP, retrying in %.1f s" %
+                                 (self._retry_at - start))
+
+        if not self.lock.acquire(timeout=deadline - start):
+            self._account(kind, "timeouts")
+            raise ESP32Exception(kind, line.decode(), "serial line busy")
+
+        try:
+            while True:
+                try:
+                    if self._reopen:
+                        self._reopen_connection()
+                    self.connection.write(line)
+                    result = read(deadline)
+                except _Timeout as exc:
+                    self._flush()
+                    outcome, output = "timeouts", str(exc)
+                    break
+                except serial.SerialException as exc:
+                    self._reopen = True
+                    outcome, output = "errors", str(exc)
+                    break
+                except Exception as exc:
+                    print("ERROR: %s failing: %s" % (line.decode().strip(), str(exc)))
+                    self._flush()
+                    outcome, output = "errors", str(exc)
+                    if time.monotonic() < deadline:
+                        continue
+                    break
+
+                now = time.monotonic()
+                self._backoff = 0.
+                self._retry_at = 0.
+                self._last_reply = now
+                self._account(kind, now - start)
+                return result
+        finally:
+            self.lock.release()
+
+        self._backoff = min(max(2 * self._backoff, self._backoff_min),
+                            self._backoff_max)
+        self._retry_at = time.monotonic() + self._backoff
+        self._account(kind, outcome)
+        raise ESP32Exception(kind, line.decode(), output)
+
+    def _fill(self):
+        """
+        Moves all the bytes waiting on the serial port into the receive
+        buffer with a single read. If none are waiting, waits for one
+        at most for the polling interval.
+        """
+
+        self._rx += self.connection.read(self.connection.in_waiting or 1)
+
+    def _wait_for(self, size, deadline):
+        """
+        Fills the receive buffer until it holds at least size bytes,
+        before the deadline
+        """
+
+        while len(self._rx) < size:
+            self._fill()
+            if len(self._rx) < size and time.monotonic() >= deadline:
+                raise _Timeout("short read: %s" % bytes(self._rx))
+
+    def _read_line(self, deadline):
+        """
+        Reads a line from the serial port before the deadline. What
+        follows the line stays in the receive buffer for the next call.
+
+        returns: the line, without terminator, as a binary buffer
+        """
+
+        start = 0
+        while True:
+            end = self._rx.find(self.term, start)
+            if end >= 0:
+                with memoryview(self._rx) as view:
+                    line = bytes(view[:end])
+                del self._rx[:end + len(self.term)]
+                return line
+
+            # the terminator may be split across two reads
+            start = max(len(self._rx) - len(self.term) + 1, 0)
+            self._fill()
+            if time.monotonic() >= deadline and self._rx.find(self.term, start) < 0:
+                raise _Timeout("no reply: '%s'" % self._rx.decode(errors='replace'))
+
+    def _read_frame(self, deadline):
+        """
+        Reads a binary telemetry frame from the ESP32
+
+        arguments:
+        - deadline       the time.monotonic() based deadline
+
+        returns: the values as a float array, in get_all_fields order
+        """
+
+        self._wait_for(_FRAME_HEADER.size, deadline)
+
+        magic, length = _FRAME_HEADER.unpack_from(self._rx)
+        if magic != FRAME_MAGIC:
+            raise Exception("frame error: bad magic %s" % magic)
+        if length != self._frame_size:
+            raise Exception("frame error: expected %d bytes, got %d" %
+                            (self._frame_size, length))
+
+        size = _FRAME_HEADER.size + length + _FRAME_CRC.size
+        self._wait_for(size, deadline)
+
+        crc, = _FRAME_CRC.unpack_from(self._rx, size - _FRAME_CRC.size)
+        with memoryview(self._rx) as view:
+            with view[_FRAME_HEADER.size:size - _FRAME_CRC.size] as payload:
+                valid = zlib.crc32(payload) == crc
+                values = np.frombuffer(payload, dtype='<f4').astype(float)
+        del self._rx[:size]
+
+        if not valid:
+            raise Exception("frame error: CRC mismatch")
+        return values
+
+    def _read_reply(self, deadline):
+        """
+        Reads a command reply from the ESP32. While streaming, replies
+        are handed over by the reader thread (or, without one, picked
+        from the port here), otherwise they are read straight from the
+        serial port.
+
+        returns: the reply line as a binary buffer
+        """
+
+        if not self.streaming:
+            return self._read_line(deadline)
+
+        while self._reader is None:
+            try:
+                return self._replies.get_nowait()
+            except Empty:
+                pass
+            if time.monotonic() >= deadline:
+                raise _Timeout("no reply")
+            self._pump(block=True)
+
+        try:
+            return self._replies.get(timeout=max(deadline - time.monotonic(), 0))
+        except Empty:
+            raise _Timeout("no reply")
+
+    def _pump(self, block):
+        """
+        Reads what the serial port received and dispatches the complete
+        frames and lines: telemetry (binary frames or 'stream=' lines)
+        goes to the stream buffer, everything else is a reply to a
+        command. Incomplete ones are left in the receive buffer,
+        malformed data (including samples without one value per
+        get_all_fields entry) is dropped.
+
+        arguments:
+        - block          if True and nothing was received, waits for
+                         data at most for the polling interval. The
+                         wait is done without the receive lock, so
+                         pump_stream() is not held up by it.
+        """
+
+        fd = self.fileno() if block else None
+        readable = False
+        if fd is not None:
+            if not self.connection.in_waiting:
+                readable = bool(select.select([fd], [], [], self.connection.timeout)[0])
+            block = False
+
+        with self._rx_lock:
+            # readable without data waiting: the port hung up, and the
+            # read reports it
+            if (block or self.connection.in_waiting or
+                    (readable and select.select([fd], [], [], 0)[0])):
+                self._fill()
+
+            try:
+                while self._rx:
+                    if self._rx[0] == FRAME_MAGIC[0]:
+                        if len(self._rx) < self._frame_total:
+                            return
+                        self._stream_buffer.append(self._read_frame(0))
+                        self._last_reply = self._last_sample = time.monotonic()
+                        continue
+
+                    if self._rx.find(self.term) < 0:
+                        if len(self._rx) > _MAX_LINE:
+                            raise Exception("line too long")
+                        return
+
+                    line = self._read_line(0)
+                    if line.startswith(_STREAM_PREFIX):
+                        values = line[len(_STREAM_PREFIX):].split(b',')
+                        if len(values) != len(self.get_all_fields):
+                            print("ERROR: stream dropping a sample of %d values" % len(values))
+                            continue
+                        self._stream_buffer.append(np.array(values, dtype=float))
+                        self._last_reply = self._last_sample = time.monotonic()
+                    elif line.startswith(_ALARM_PREFIX):
+                        self._last_reply = time.monotonic()
+                        alarm, warning = line[len(_ALARM_PREFIX):].split(b',')
+                        if self._alarm_callback is not None:
+                            self._alarm_callback(int(alarm), int(warning),
+                                                 self._last_reply)
+                    else:
+                        self._replies.put(line)
+            except Exception as exc:
+                self._rx.clear()
+                print("ERROR: stream failing: %s" % str(exc))
+
+    def _read_stream(self):
+        """
+        The body of the reader thread, active in streaming mode.
+        """
+
+        while self.streaming:
+            try:
+                self._pump(block=True)
+            except serial.SerialException as exc:
+                print("ERROR: stream failing: %s" % str(exc))
+                self._reader_error = exc
+                self._reopen = True
+                return
+
+    def subscribe_alarms(self, callback):
+        """
+        Registers the function called when the ESP reports new alarm
+        or warning bitmasks, in streaming mode with the "alarm_events"
+        protocol feature. It is called from the reader thread, or from
+        pump_stream() if there is none.
+
+        arguments:
+        - callback       called with the alarm and warning bitmasks,
+                         and the time.monotonic() they were received
+        """
+
+        self._alarm_callback = callback
+
+    def pump_stream(self):
+        """
+        Collects the data received in streaming mode, without waiting,
+        when no reader thread was started (see start_streaming()). To
+        be called when the serial port is readable, e.g. from a
+        QSocketNotifier on fileno(). The samples are then retrieved
+        with drain_stream().
+        """
+
+        try:
+            self._pump(block=False)
+        except serial.SerialException as exc:
+            self._reader_error = exc
+            self._reopen = True
+            raise ESP32Exception("stream", "stream on", str(exc))
+
+    def fileno(self):
+        """
+        returns: the file descriptor of the serial port, None if the
+        platform does not provide one.
+        """
+
+        try:
+            return self.connection.fileno()
+        except (AttributeError, serial.SerialException):
+            return None
+
+    def start_streaming(self, period, reader=True):
+        """
+        Asks the ESP32 to push telemetry continuously. The samples
+        are collected by a reader thread and retrieved with
+        drain_stream().
+
+        arguments:
+        - period         the time between two samples, in seconds
+        - reader         if False, no reader thread is started and the
+                         caller has to call pump_stream() as soon as
+                         data is available
+
+        returns: an "OK" string in case of success.
+        """
+
+        if self.streaming:
+            return "OK"
+
+        self._reader_error = None
+        self._stream_buffer.clear()
+        self._stream_period = period
+        self._last_sample = time.monotonic()
+        self.streaming = True
+        if reader:
+            self._reader = Thread(target=self._read_stream, daemon=True)
+            self._reader.start()
+
+        try:
+            return self.resume_streaming()
+        except ESP32Exception:
+            self.stop_streaming()
+            raise
+
+    def resume_streaming(self):
+        """
+        Sends "stream on" again, e.g. if the stream stalled because the
+        ESP was reset. The reader thread, if any, is kept.
+
+        returns: an "OK" string in case of success.
+        """
+
+        command = 'stream on ' + str(int(self._stream_period * 1000))
+        if self.binary_frames:
+            command += ' frame'
+        return self._command(command)
+
+    def restart_streaming(self, reader=True):
+        """
+        Restarts the stream after a communication error: stops the
+        reader thread, reopens the serial port if it failed, and starts
+        streaming again at the same period, right away even if the
+        failed requests are backing off.
+
+        arguments:
+        - reader         see start_streaming()
+
+        returns: an "OK" string in case of success.
+        """
+
+        self.streaming = False
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+
+        self._retry_at = 0.
+        with self.lock:
+            if self._reopen:
+                self._reopen_connection()
+            with self._rx_lock:
+                self._rx.clear()
+
+        return self.start_streaming(self._stream_period, reader)
+
+    def stop_streaming(self):
+        """
+        Stops the telemetry stream and the reader thread.
+
+        returns: an "OK" string in case of success.
+        """
+
+        if not self.streaming:
+            return "OK"
+
+        try:
+            return self._command('stream off')
+        finally:
+            self.streaming = False
+            if self._reader is not None:
+                self._reader.join()
+                self._reader = None
+            # drop the samples sent before the ESP processed "stream off"
+            with self._rx_lock:
+                while self.connection.read():
+                    pass
+                self._rx.clear()
+
+    def drain_stream(self):
+        """
+        Returns all the samples received since the previous call
+
+        returns: a 2D float array, one row per sample, the columns in
+        get_all_fields order.
+        """
+
+        if self._reader_error is not None:
+            raise ESP32Exception("stream", "stream on", str(self._reader_error))
+
+        samples = []
+        while self._stream_buffer:
+            samples.append(self._stream_buffer.popleft())
+
+        if not samples:
+            return np.empty((0, len(self.get_all_fields)))
+        return np.vstack(samples)
+
+    def _command(self, command, kind="command"):
+        """
+        Sends a command whose reply is a single 'valore=' line.
+        If the ESP supports the "pipeline" protocol feature the command
+        is tagged, so that the late reply of an expired request cannot
+        be mistaken for this one.
+
+        arguments:
+        - command        the command, without line terminator
+        - kind           the request kind, see the deadlines
+
+        returns: the parsed reply
+        """
+
+        if "pipeline" not in self.protocol:
+            return self._transact(kind, (command + '\r\n').encode(),
+                                  lambda deadline: self._parse(self._read_reply(deadline)))
+
+        tag = str(next(self._tags) % 0x10000)
+
+        def read(deadline):
+            while True:
+                reply_tag, value = self._parse_tagged(self._read_reply(deadline))
+                if reply_tag == tag:
+                    return value
+
+        return self._transact(kind, ('#' + tag + ' ' + command + '\r\n').encode(), read)
+
+    def batch(self, kind="command"):
+        """
+        Groups several commands in a single round-trip. If the ESP
+        supports the "pipeline" protocol feature the commands are
+        tagged and written back-to-back, and the replies are matched
+        by tag; otherwise they are executed one after the other.
+
+        Example usage:
+
+        ```
+        with esp32.batch() as batch:
+            run = batch.get("run")
+            mode = batch.get("mode")
+        print(run.result(), mode.result())
+        ```
+
+        arguments:
+        - kind           the request kind, see the deadlines
+
+        returns: an ESP32Batch instance, to be used as context manager
+        """
+
+        return ESP32Batch(self, kind)
+
+    def _run_batch(self, requests, kind):
+        """
+        Executes the commands collected by an ESP32Batch
+
+        arguments:
+        - requests       a list of (verb, arguments, future) tuples
+        - kind           the request kind, see the deadlines
+        """
+
+        if "pipeline" not in self.protocol:
+            for verb, args, future in requests:
+                try:
+                    future.set_result(getattr(self, verb)(*args, kind=kind))
+                except Exception as exc:
+                    future.set_exception(exc)
+                    raise
+            return
+
+        pending = {}
+        lines = []
+        for verb, args, future in requests:
+            tag = str(next(self._tags) % 0x10000)
+            command = ' '.join([verb] + [str(arg) for arg in args])
+            pending[tag] = future
+            lines.append('#' + tag + ' ' + command + '\r\n')
+
+        print("ESP32Serial-DEBUG: batch of %d commands" % len(lines))
+
+        def read(deadline):
+            while any(not future.done() for future in pending.values()):
+                tag, value = self._parse_tagged(self._read_reply(deadline))
+                # a late reply from a previous request is just dropped
+                if tag in pending and not pending[tag].done():
+                    pending[tag].set_result(value)
+
+        try:
+            self._transact(kind, ''.join(lines).encode(), read)
+        except ESP32Exception as error:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            raise
+
+    def _parse_tagged(self, result):
+        """
+        Parses a tagged reply, i.e. '#<tag> valore=<value>'
+
+        arguments:
+        - result         what the ESP replied as a binary buffer
+
+        returns: the tag and the value as strings
+        """
+
+        space = result.find(b' ')
+        if not result.startswith(b'#') or space < 0:
+            raise Exception("protocol error: '#' expected")
+
+        return result[1:space].decode(), self._parse(result[space + 1:])
+
     def _parse(self, result):
         """
         Parses the message from ESP32
@@ -91,14 +908,11 @@ class ESP32Serial:
         returns the requested value as a string
         """
 
-        check_str, value = result.decode().split('=')
-        check_str = check_str.strip()
-
-        if check_str != 'valore':
+        if not result.startswith(_REPLY_PREFIX):
             raise Exception("protocol error: 'valore=' expected")
-        return value.strip()
+        return result[len(_REPLY_PREFIX):].strip().decode()
 
-    def set(self, name, value):
+    def set(self, name, value, kind="command"):
         """
         Set command wrapper
 
@@ -106,29 +920,17 @@ class ESP32Serial:
         - name           the parameter name as a string
         - value          the value to assign to the variable as any type
                          convertible to string
+        - kind           the request kind, see the deadlines
 
         returns: an "OK" string in case of success.
         """
 
         print("ESP32Serial-DEBUG: set %s %s" % (name, value))
 
-        with self.lock:
-            # I know about Python 3.7 magic string formatting capability
-            # but I don't really remember now the version running on
-            # Raspbian
-            command = 'set ' + name + ' ' + str(value) + '\r\n'
-            self.connection.write(command.encode())
-
-            result = b""
-            retry = 10
-            while retry:
-                retry -= 1
-                try:
-                    result = self.connection.read_until(terminator=self.term)
-                    return self._parse(result)
-                except Exception as exc:
-                    print("ERROR: set failing: %s %s" % (result.decode(), str(exc)))
-            raise ESP32Exception("set", command, result.decode())
+        # I know about Python 3.7 magic string formatting capability
+        # but I don't really remember now the version running on
+        # Raspbian
+        return self._command('set ' + name + ' ' + str(value), kind)
 
     def set_watchdog(self):
         """
@@ -137,34 +939,65 @@ class ESP32Serial:
         returns: an "OK" string in case of success.
         """
 
-        return self.set("watchdog_reset", 1)
+        return self.set("watchdog_reset", 1, kind="watchdog")
 
-    def get(self, name):
+    def get(self, name, kind="command"):
         """
         Get command wrapper
 
         arguments:
         - name           the parameter name as a string
+        - kind           the request kind, see the deadlines
 
         returns: the requested value
         """
 
         print("ESP32Serial-DEBUG: get %s" % name)
 
-        with self.lock:
-            command = 'get ' + name + '\r\n'
-            self.connection.write(command.encode())
+        return self._command('get ' + name, kind)
 
-            result = b""
-            retry = 10
-            while retry:
-                retry -= 1
-                try:
-                    result = self.connection.read_until(terminator=self.term)
-                    return self._parse(result)
-                except Exception as exc:
-                    print("ERROR: get failing: %s %s" % (result.decode(), str(exc)))
-            raise ESP32Exception("get", command, result.decode())
+    def get_many(self, names, kind="command"):
+        """
+        Get several parameters in a single round-trip. If the ESP does
+        not support the "many" protocol feature, the values are read
+        with a batch.
+
+        arguments:
+        - names          a list of parameter names
+        - kind           the request kind, see the deadlines
+
+        returns: a dict name -> value, the values as strings
+        """
+
+        if "many" not in self.protocol:
+            with self.batch(kind) as batch:
+                replies = [batch.get(name) for name in names]
+            return {name: reply.result() for name, reply in zip(names, replies)}
+
+        print("ESP32Serial-DEBUG: get %s" % ','.join(names))
+
+        command = 'get ' + ','.join(names)
+        values = self._command(command, kind).split(',')
+        if len(values) != len(names):
+            raise ESP32Exception(kind, command, ','.join(values))
+
+        return dict(zip(names, values))
+
+    def get_all_values(self):
+        """
+        Get the observables as listed in the get_all_fields internal
+        object, using the binary frame protocol if it was negotiated.
+
+        returns: a float array with the values in get_all_fields order.
+        """
+
+        if self.streaming:
+            raise ESP32Exception("telemetry", "get all", "not available while streaming, use drain_stream()")
+
+        if not self.binary_frames:
+            return np.array(list(self.get_all().values()), dtype=float)
+
+        return self._transact("telemetry", b"get all_frame\r\n", self._read_frame)
 
     def get_all(self):
         """
@@ -172,29 +1005,26 @@ class ESP32Serial:
         object.
 
         returns: a dict with member keys as written above and values as
-        strings.
+        strings (floats if the binary frame protocol is in use).
         """
 
+        if self.binary_frames:
+            return dict(zip(self.get_all_fields,
+                            self.get_all_values().tolist()))
+
         print("ESP32Serial-DEBUG: get all")
 
-        with self.lock:
-            self.connection.write(b"get all\r\n")
+        if self.streaming:
+            raise ESP32Exception("telemetry", "get all", "not available while streaming, use drain_stream()")
 
-            result = b""
-            retry = 10
-            while retry:
-                retry -= 1
-                try:
-                    result = self.connection.read_until(terminator=self.term)
-                    values = self._parse(result).split(',')
+        values = self._command("get all", "telemetry").split(',')
 
-                    if len(values) != len(self.get_all_fields):
-                        raise Exception("get_all answer mismatch: expected: %s, got %s" % (self.get_all_fields, values))
+        if len(values) != len(self.get_all_fields):
+            raise ESP32Exception("telemetry", "get all",
+                                 "get_all answer mismatch: expected: %s, got %s" %
+                                 (self.get_all_fields, values))
 
-                    return dict(zip(self.get_all_fields, values))
-                except Exception as exc:
-                    print("ERROR: get failing: %s %s" % (result.decode(), str(exc)))
-            raise ESP32Exception("get", "get all", result.decode())
+        return dict(zip(self.get_all_fields, values))
 
     def get_alarms(self):
         """
@@ -203,7 +1033,7 @@ class ESP32Serial:
         returns: a ESP32Alarm instance describing the possible alarms.
         """
 
-        return ESP32Alarm(int(self.get("alarm")))
+        return ESP32Alarm(int(self.get("alarm", kind="alarm")))
 
     def get_warnings(self):
         """
@@ -212,7 +1042,7 @@ class ESP32Serial:
         returns: a ESP32Warning instance describing the possible warnings.
         """
 
-        return ESP32Warning(int(self.get("warning")))
+        return ESP32Warning(int(self.get("warning", kind="alarm")))
 
     def reset_alarms(self):
         """
@@ -221,7 +1051,7 @@ class ESP32Serial:
         returns: an "OK" string in case of success.
         """
 
-        return self.set("alarm", 0)
+        return self.set("alarm", 0, kind="alarm")
 
     def reset_warnings(self):
         """
@@ -230,7 +1060,7 @@ class ESP32Serial:
         returns: an "OK" string in case of success.
         """
 
-        return self.set("warning", 0)
+        return self.set("warning", 0, kind="alarm")
 
     def raise_gui_alarm(self):
         """
@@ -242,7 +1072,7 @@ class ESP32Serial:
         returns: an "OK" string in case of success.
         """
 
-        return self.set("alarm", 1)
+        return self.set("alarm", 1, kind="alarm")
 
     def snooze_hw_alarm(self, alarm_type):
         """
@@ -260,7 +1090,7 @@ class ESP32Serial:
         bitmap = { 1 << x: x for x in range(32)}
 
         pos = bitmap[alarm_type]
-        return self.set("alarm_snooze", pos)
+        return self.set("alarm_snooze", pos, kind="alarm")
 
     def snooze_gui_alarm(self):
         """
@@ -269,4 +1099,4 @@ class ESP32Serial:
         returns: an "OK" string in case of success.
         """
 
-        return self.set("alarm_snooze", 29)
+        return self.set("alarm_snooze", 29, kind="alarm")
@@ -5,10 +5,11 @@ ESP32 chip isn't available.
 
 import random
 import time
+import numpy as np
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtGui import QTextCursor
 from communication.peep import peep
-from . import ESP32Alarm, ESP32Warning
+from . import ESP32Alarm, ESP32Warning, ESP32Batch
 
 class FakeMonitored(QtWidgets.QWidget):
     def __init__(self, name, generator, value=0, random=True):
@@ -39,6 +40,7 @@ class FakeMonitored(QtWidgets.QWidget):
 
 class FakeESP32Serial(QtWidgets.QMainWindow):
     peep = peep()
+    protocol = {"stream"}
     def __init__(self, config):
         super(FakeESP32Serial, self).__init__()
 
@@ -46,6 +48,11 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
         self.get_all_fields = config["get_all_fields"]
         self.observables = {name: None for name in self.get_all_fields}
 
+        self.streaming = False
+        self._stream_period = None
+        self._stream_last = None
+        self._stream_buffer_size = config.get("stream_buffer_size", 1000)
+
         self._arrange_fields()
         self.alarms_checkboxes = {}
         self.warning_checkboxes = {}
@@ -191,7 +198,7 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
         c = self.event_log.textCursor();
         c.movePosition(QTextCursor.End);
 
-    def set(self, name, value):
+    def set(self, name, value, kind="command"):
         """
         Set command wrapper
 
@@ -199,6 +206,7 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
         - name           the parameter name as a string
         - value          the value to assign to the variable as any type
                          convertible to string
+        - kind           the request kind, ignored
 
         returns: an "OK" string in case of success.
         """
@@ -220,12 +228,13 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
 
         return self.set("watchdog_reset", 1)
 
-    def get(self, name):
+    def get(self, name, kind="command"):
         """
         Get command wrapper
 
         arguments:
         - name           the parameter name as a string
+        - kind           the request kind, ignored
 
         returns: the requested value
         """
@@ -249,6 +258,19 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
 
         return str(retval)
 
+    def get_many(self, names, kind="command"):
+        """
+        Get several parameters at once
+
+        arguments:
+        - names          a list of parameter names
+        - kind           the request kind, ignored
+
+        returns: a dict name -> value, the values as strings
+        """
+
+        return {name: self.get(name) for name in names}
+
     def get_all(self):
         """
         Get the pressure, flow, o2, and bpm at once and in this order.
@@ -263,6 +285,141 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
 
         return dict(zip(self.get_all_fields, values))
 
+    def batch(self, kind="command"):
+        """
+        Groups several commands, see ESP32Serial.batch()
+
+        returns: an ESP32Batch instance, to be used as context manager
+        """
+
+        return ESP32Batch(self, kind)
+
+    def _run_batch(self, requests, kind):
+        """
+        Executes the commands collected by an ESP32Batch
+
+        arguments:
+        - requests       a list of (verb, arguments, future) tuples
+        - kind           the request kind, ignored
+        """
+
+        for verb, args, future in requests:
+            future.set_result(getattr(self, verb)(*args))
+
+    def get_all_values(self):
+        """
+        Get the observables as listed in the get_all_fields internal
+        object.
+
+        returns: a float array with the values in get_all_fields order.
+        """
+
+        return np.array([float(self.get(field))
+                         for field in self.get_all_fields])
+
+    def start_streaming(self, period, reader=True):
+        """
+        Starts generating samples every period seconds, to be
+        retrieved with drain_stream(). There is no reader thread
+        anyway.
+
+        returns: an "OK" string in case of success.
+        """
+
+        self.log("stream on")
+        self.streaming = True
+        self._stream_period = period
+        self._stream_last = time.time()
+        return "OK"
+
+    def resume_streaming(self):
+        """
+        The fake stream never stalls.
+
+        returns: an "OK" string in case of success.
+        """
+
+        self.log("stream on")
+        return "OK"
+
+    def restart_streaming(self, reader=True):
+        """
+        Starts generating samples again, at the same period.
+
+        returns: an "OK" string in case of success.
+        """
+
+        self.streaming = False
+        return self.start_streaming(self._stream_period, reader)
+
+    def stop_streaming(self):
+        """
+        Stops generating samples.
+
+        returns: an "OK" string in case of success.
+        """
+
+        self.log("stream off")
+        self.streaming = False
+        return "OK"
+
+    def pump_stream(self):
+        """
+        Nothing to collect, samples are generated by drain_stream().
+        """
+
+    def fileno(self):
+        """
+        returns: None, there is no serial port to watch.
+        """
+
+        return None
+
+    def drain_stream(self):
+        """
+        Returns the samples generated since the previous call
+
+        returns: a 2D float array, one row per sample, the columns in
+        get_all_fields order.
+        """
+
+        now = time.time()
+        n_samples = int((now - self._stream_last) / self._stream_period)
+        self._stream_last += n_samples * self._stream_period
+        n_samples = min(n_samples, self._stream_buffer_size)
+
+        samples = np.empty((n_samples, len(self.get_all_fields)))
+        for i in range(n_samples):
+            samples[i] = self.get_all_values()
+        return samples
+
+    def latency_histogram(self):
+        """
+        No serial line, no latencies.
+
+        returns: an empty dict
+        """
+
+        return {}
+
+    def link_down_for(self):
+        """
+        The fake ESP always answers.
+
+        returns: 0
+        """
+
+        return 0.
+
+    def stream_stalled_for(self):
+        """
+        The fake stream never stalls.
+
+        returns: 0
+        """
+
+        return 0.
+
     def get_alarms(self):
         """
         Get the alarms from the ESP32
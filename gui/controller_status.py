@@ -5,6 +5,7 @@ Constanty checks the status of the ESP controller.
 from PyQt5.QtCore import QTimer
 import sys
 from messagebox import MessageBox
+from communication.esp32serial import ESP32Exception
 
 
 class ControllerStatus:
@@ -15,13 +16,14 @@ class ControllerStatus:
     Has it entered backup mode?
     '''
 
-    def __init__(self, config, esp32, settings, start_stop_worker):
+    def __init__(self, config, esp32, dispatcher, settings, start_stop_worker):
         '''
         Constructor
 
         arguments:
         - config: the dictionary storing the configuration
         - esp32: the esp32serial object
+        - dispatcher: the ESP32Dispatcher running the ESP requests
         - settings: the Settings panel
         - start_stop_worker: the StartStopWorker class
                              that takes care of start/stop operations
@@ -29,6 +31,8 @@ class ControllerStatus:
 
         self._config = config
         self._esp32 = esp32
+        self._dispatcher = dispatcher
+        self._request = None
         self._settings = settings
         self._start_stop_worker = start_stop_worker
 
@@ -61,26 +65,60 @@ class ControllerStatus:
     def _esp32_io(self):
         '''
         The callback function called every time the
-        QTimer times out.
+        QTimer times out. Queues the status request
+        in the dispatcher.
         '''
 
-        try:
-            self._call_esp32()
-        except Exception as error:
-            self._open_comm_error(str(error))
+        # don't pile up requests if the ESP is slower than the timer
+        if self._request is not None and not self._request.done():
+            return
+
+        self._request = self._dispatcher.submit(
+                self._dispatcher.PRIORITY_ALARM,
+                self._call_esp32,
+                callback=self._update_status,
+                errback=self._comm_error)
+
+
+    def _comm_error(self, error):
+        '''
+        Stops polling and opens the communication error window,
+        unless the ESP has been silent for less than comm_error_timeout.
+        '''
+        if (isinstance(error, ESP32Exception) and
+                self._esp32.link_down_for() < self._config['comm_error_timeout']):
+            print('Ignoring ESP error:', error)
+            return
+
+        self._stop_timer()
+        self._open_comm_error(str(error))
 
 
     def _call_esp32(self):
         '''
         Gets the run, mode and backup vairables
-        from the ESP, and passes them to the
-        StartStopWorker class.
+        from the ESP. Runs in the dispatcher thread.
         '''
 
-        self._start_stop_worker.set_run(int(self._esp32.get('run')))
-        self._start_stop_worker.set_mode(int(self._esp32.get('mode')))
+        status = self._esp32.get_many(['run', 'mode', 'backup'], kind="status")
+
+        return (int(status['run']),
+                int(status['mode']),
+                int(status['backup']))
+
+
+    def _update_status(self, status):
+        '''
+        Passes the run, mode and backup variables
+        to the StartStopWorker class.
+        '''
+
+        run, mode, backup = status
+
+        self._start_stop_worker.set_run(run)
+        self._start_stop_worker.set_mode(mode)
 
-        if int(self._esp32.get('backup')):
+        if backup:
             if not self._backup_ackowledged:
                 self._open_backup_warning()
         else:
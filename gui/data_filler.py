@@ -1,8 +1,15 @@
 from PyQt5 import QtGui, QtCore
+import time
 import numpy as np
 import pyqtgraph as pg
 from ast import literal_eval # to convert a string to list
-from copy import copy 
+from sample_store import SampleStore
+from trend_store import TrendStore
+from sliding_minmax import SlidingMinMax
+from breath_analyzer import BreathAnalyzer
+from decimator import Decimator
+from looping_curve import LoopingCurve
+from history import History
 
 class DataFiller():
     '''
@@ -13,29 +20,82 @@ class DataFiller():
 
     In "frozen" mode, we keep adding new data points to _data,
     but don't update the displayed graph. When we unfreeze, we
-    then see the full recent data.
+    then see the full recent data. While frozen, the plots show
+    separate curves with the data of the visible time range, loaded
+    from the History when the range changes: they can be scrolled
+    and zoomed back through the whole recorded history.
+
+    The samples are kept in SampleStores, one column per sample of
+    all the get_all_fields, and the plots display views of them:
+    nothing is shifted nor copied when samples are added.
+
+    Adding samples only marks the plots and monitors as dirty:
+    they are redrawn by a render QTimer, at most plot_max_fps times
+    per second, whatever the sampling rate. When a plot is narrower
+    than half the samples, it shows them reduced by a Decimator to
+    two points per pixel. Looping plots are drawn by LoopingCurves,
+    which redraw only the segments where samples were written.
+
+    The monitors listed in breath_monitors show a metric of the last
+    breath instead, and are updated once per breath.
     '''
 
     def __init__(self, config):
         self._qtgraphs = {}
         self._plots = {}
-        self._data = {}
-        self._historic_data = {}
+        self._historic_minmax = {}
         self._monitors = {}
+        self._breath_monitors = {}
         self._colors = {}
+        self._pens = {}
         self._default_ranges = {}
+        self._y_ranges = {}
+        self._decimators = {}
+        self._dirty_plots = set()
+        self._dirty_monitors = set()
         self._config = config
         self._n_samples = self._config['nsamples']
         self._n_historic_samples = self._config.get('historic_nsamples',
                 200)
+        self._percentiles = self._config.get('autoscale_percentiles')
+        self._hysteresis = self._config.get('autoscale_hysteresis', 0.)
+        fields = self._config['get_all_fields']
+        self._data = SampleStore(fields, self._n_samples)
+        self._historic_data = SampleStore(fields, self._n_historic_samples)
+        self.trends = TrendStore(self._config)
+        self.history = History(self.trends)
+        self.breaths = BreathAnalyzer(self._config)
+        self.breaths.subscribe(self.update_breath_monitors)
+        self._breath_fields = self._config.get('breath_monitors') or {}
+
+        # Conversion factors, aligned with the get_all_fields order
+        conv = self._config['conversions']
+        self._conversions = np.array([conv.get(f, 1.) for f in fields])
         self._sampling = self._config['sampling_interval']
         self._time_window = self._n_samples * self._sampling # seconds
         self._xdata = np.linspace(-self._time_window, 0, self._n_samples)
+        self._positions = np.arange(self._n_samples)
         self._frozen = False
+        self._frozen_curves = {}
+        self._frozen_recent = {}
+        self._frozen_time = None
+        self._last_time = time.time()
         self._first_plot = None
         self._looping = self._config['use_looping_plots']
-        self._looping_data_idx = {}
         self._looping_lines = {}
+        self._decimation = self._config.get('plot_decimation')
+        self._count = 0
+
+        self._render_timer = QtCore.QTimer()
+        self._render_timer.timeout.connect(self.render)
+        self._render_timer.start(int(1000 / self._config.get('plot_max_fps', 25)))
+
+        # While frozen, the history is loaded once the range stops
+        # changing for a frame
+        self._history_timer = QtCore.QTimer()
+        self._history_timer.setSingleShot(True)
+        self._history_timer.setInterval(int(1000 / self._config.get('plot_max_fps', 25)))
+        self._history_timer.timeout.connect(self.load_history)
         return
 
     def connect_plot(self, plotname, plot):
@@ -53,12 +113,18 @@ class DataFiller():
             self._first_plot = plot
 
         self._qtgraphs[name] = plot
-        self._plots[name] = plot.plot()
-        self._data[name] = np.linspace(0, 0, self._n_samples)
-        self._historic_data[name] = np.linspace(0, 0, self._n_historic_samples)
-        self._plots[name].setData(copy(self._xdata), copy(self._data[name]))
         self._colors[name] = plot_config['color']
-        self._looping_data_idx[name] = 0
+        self._pens[name] = pg.mkPen(self.parse_color(self._colors[name]),
+                                    width=self._config['line_width'])
+        if self._looping:
+            self._plots[name] = LoopingCurve(plot, self._pens[name], self._n_samples,
+                                             self._config.get('looping_segments', 10))
+        else:
+            self._plots[name] = plot.plot(pen=self._pens[name])
+        self._historic_minmax[name] = SlidingMinMax(self._n_historic_samples)
+        self._plots[name].setData(self._xdata, self._plot_view(name))
+        self._frozen_curves[name] = plot.plot(pen=self._pens[name], name='frozen')
+        self._frozen_curves[name].setVisible(False)
 
         # Set the Y axis
         y_axis_label = plot_config['name']
@@ -113,17 +179,30 @@ class DataFiller():
         # Also set the width (space) on the left of the Y axis (for the label and ticks)
         self._qtgraphs[name].getAxis('left').setWidth(self._config['left_ax_label_space'])
 
+    def historic_bounds(self, name):
+        '''
+        Returns the min and max of the historic data set, or the
+        autoscale_percentiles of it if configured (robust to spikes).
+        '''
+        if self._percentiles is not None:
+            return np.percentile(self._historic_data.view(name),
+                                 self._percentiles)
+
+        minmax = self._historic_minmax[name]
+        return minmax.min(), minmax.max()
+
     def set_y_range(self, name):
         '''
         Set the Y axis range of the plot to the max and min
-        from the historic data set.
+        from the historic data set. The axis is left alone while
+        the data fits in it and does not shrink by more than the
+        autoscale_hysteresis fraction of it.
         '''
         if name not in self._historic_data or name not in self._qtgraphs:
             raise Exception('Cannot set y range for graph', name, 'as it doesn\'t exist.')
 
         # Calculate the max and min using the larger historical data sample
-        ymax = np.max(self._historic_data[name])
-        ymin = np.min(self._historic_data[name])
+        ymin, ymax = self.historic_bounds(name)
 
         if ymax == ymin:
             return
@@ -132,6 +211,14 @@ class DataFiller():
         ymax += span * 0.1
         ymin -= span * 0.1
 
+        if name in self._y_ranges:
+            shown_min, shown_max = self._y_ranges[name]
+            band = (shown_max - shown_min) * self._hysteresis
+            if (shown_min <= ymin <= shown_min + band and
+                    shown_max - band <= ymax <= shown_max):
+                return
+        self._y_ranges[name] = (ymin, ymax)
+
         self._qtgraphs[name].setYRange(ymin, ymax)
 
         self.updateTicks(name, ymax - ymin)
@@ -208,58 +295,77 @@ class DataFiller():
 
         plot.addItem(self._looping_lines[name])
 
+    def connect_recorder(self, recorder):
+        '''
+        Makes the frozen plots load the history from the samples
+        recorded on disk
+
+        arguments:
+        - recorder: the Recorder, or None
+        '''
+        self.history.recorder = recorder
+
     def connect_monitor(self, monitor):
         '''
         Connect a monitor to this class by
         storing it in a dictionary
         '''
         name = monitor.observable
-        self._monitors[name] = monitor
-
-        self._data[name] = np.linspace(0, 0, self._n_samples)
-
-        self._looping_data_idx[name] = 0
-
-
-        if name not in self._data:
-            self._data[name] = np.linspace(0, 0, self._n_samples)
+        if name in self._breath_fields:
+            self._breath_monitors[name] = monitor
+        else:
+            self._monitors[name] = monitor
 
         print('NORMAL: Connected monitor', monitor.configname , 'with variable', name)
 
-    def add_data_point(self, name, data_point):
+    def add_samples(self, samples):
         '''
-        Adds a data point to the plot with
-        name 'name'
+        Adds samples for all the plots and monitors at once
+
+        arguments:
+        - samples: a sample as read from the ESP (one value per field,
+                   in get_all_fields order), or a 2-D block of them,
+                   one row per sample
+
+        returns: the samples after applying the conversions, as a
+        2-D block
         '''
 
-        # print('NORMAL: Received data for monitor', name)
+        samples = np.atleast_2d(samples) * self._conversions
+        if not len(samples):
+            return samples
+        self._last_time = time.time()
 
-        if name in self._historic_data:
-            # Save to the historic data dict
-            self._historic_data[name][:-1] = self._historic_data[name][1:]
-            self._historic_data[name][-1] = data_point
+        # Looping plots show the store in storage order, the
+        # scrolling ones from the oldest to the newest sample
+        self._data.append(samples)
+        self._count += len(samples)
+        self._historic_data.append(samples)
+        self.trends.add_samples(samples, self._last_time)
+        self.breaths.add_samples(samples)
 
-        if name in self._data:
-            if self._looping:
-                # Looping plots - update next value
-                self._data[name][self._looping_data_idx[name]] = data_point
+        for name, minmax in self._historic_minmax.items():
+            minmax.extend(samples[:, self._data.index(name)])
 
-                self._looping_data_idx[name] += 1
+        self._dirty_plots.update(self._plots)
+        self._dirty_monitors.update(self._monitors)
 
-                if self._looping_data_idx[name] == self._n_samples:
-                    self._looping_data_idx[name] = 0
-            else:
-                # Scrolling plots - shift data 1 sample left
-                self._data[name][:-1] = self._data[name][1:]
+        return samples
 
-                # add the last data point
-                self._data[name][-1] = data_point
+    def render(self):
+        '''
+        Redraws the plots and monitors that received data since the
+        previous call. Called by the render QTimer.
+        '''
 
-        if name in self._plots:
-            self.update_plot(name)
+        if not self._frozen:
+            for name in self._dirty_plots:
+                self.update_plot(name)
+            self._dirty_plots.clear()
 
-        if name in self._monitors:
+        for name in self._dirty_monitors:
             self.update_monitor(name)
+        self._dirty_monitors.clear()
 
     def update_plot(self, name):
         '''
@@ -269,20 +375,59 @@ class DataFiller():
         if not self._frozen:
             # Update the displayed plot with current data.
             # In frozen mode, we don't update the display.
-            color = self._colors[name]
-            color = color.replace('rgb', '')
-            color = literal_eval(color)
-            self._plots[name].setData(copy(self._xdata),
-                                      copy(self._data[name]),
-                                      pen=pg.mkPen(color, width=self._config['line_width']))
-            self.set_default_x_range(name)
+            # The pen was set in connect_plot, and the x range does
+            # not change (reset_zoom restores it after a freeze).
+            index, values = self._decimated(name)
+            if self._looping:
+                decimator = self._decimators.get(name)
+                self._plots[name].update(self._xdata, index, values,
+                                         self._data.head, self._count,
+                                         decimator.bucket if decimator else 0)
+            else:
+                self._plots[name].setData(self._xdata[index], values)
             self.set_y_range(name)
 
             if self._looping:
-                x_val = self._xdata[self._looping_data_idx[name]] - self._sampling * 0.1
+                x_val = self._xdata[self._data.head] - self._sampling * 0.1
                 self._looping_lines[name].setValue(x_val)
 
+    def _plot_view(self, name):
+        '''
+        Returns the data to display for a plot, as a view on the
+        SampleStore: in storage order for looping plots, from the
+        oldest to the newest point for scrolling plots.
+        '''
+        if self._looping:
+            return self._data.raw(name)
+        return self._data.view(name)
+
+
+    def _decimated(self, name):
+        '''
+        Returns the data to display for a plot, decimated to two
+        points per pixel if there are more samples than that, as the
+        indexes of the points in the plot view and their values.
+        The plots not laid out yet (no width) are not decimated.
+        '''
+
+        points = 2 * self._qtgraphs[name].width()
+        if not self._decimation or points <= 0 or points >= self._n_samples:
+            if self._decimators.pop(name, None) is not None and self._looping:
+                self._plots[name].invalidate()
+            return self._positions, self._plot_view(name)
+
+        # the number of points changes only when the plot is resized
+        decimator = self._decimators.get(name)
+        if decimator is None or decimator.points != points:
+            decimator = Decimator(self._n_samples, points, self._decimation)
+            self._decimators[name] = decimator
+            if self._looping:
+                self._plots[name].invalidate()
 
+        decimator.update(self._data.raw(name), self._data.head, self._count)
+        if self._looping:
+            return decimator.looping()
+        return decimator.scrolling()
 
     def freeze(self):
         '''
@@ -290,10 +435,51 @@ class DataFiller():
         interaction is enabled.
         '''
         self._frozen = True
+        self._frozen_time = self._last_time
+
+        # The live curves show views of the buffers, which keep
+        # changing: the frozen ones show a copy of the last samples,
+        # in time order, and the history before them
+        times = self._frozen_time + self._xdata
+        for name, plot in self._plots.items():
+            self._frozen_recent[name] = (times, self._data.view(name).copy())
+            plot.setVisible(False)
+            self._frozen_curves[name].setVisible(True)
+            if self._looping:
+                self._looping_lines[name].setVisible(False)
+        self.load_history()
+
+        # the X axes are linked: the first plot range is enough
+        if self._first_plot is not None:
+            self._first_plot.getViewBox().sigXRangeChanged.connect(self._schedule_history)
 
         for plot in self._qtgraphs.values():
             plot.setMouseEnabled(x=True, y=True)
 
+    def _schedule_history(self, *args):
+        '''
+        Loads the history after the next frame, unless the range
+        changes again
+        '''
+        self._history_timer.start()
+
+    def load_history(self):
+        '''
+        Loads the data of the frozen plots over their visible range,
+        at about two points per pixel
+        '''
+
+        if not self._frozen or self._first_plot is None:
+            return
+
+        start, end = self._first_plot.viewRange()[0]
+        points = 2 * self._first_plot.width()
+        for name, curve in self._frozen_curves.items():
+            times, values = self.history.load(name, self._frozen_time + start,
+                                              self._frozen_time + min(end, 0), points,
+                                              self._frozen_recent[name])
+            curve.setData(times - self._frozen_time, values)
+
     def unfreeze(self):
         '''
         Leave "frozen" mode, resetting the zoom and showing self-updating
@@ -301,8 +487,22 @@ class DataFiller():
         '''
         self._frozen = False
 
+        if self._first_plot is not None:
+            try: self._first_plot.getViewBox().sigXRangeChanged.disconnect(self._schedule_history)
+            except TypeError: pass
+        self._history_timer.stop()
+        self._frozen_recent.clear()
+
+        for name, plot in self._plots.items():
+            self._frozen_curves[name].setVisible(False)
+            self._frozen_curves[name].setData([], [])
+            plot.setVisible(True)
+            if self._looping:
+                self._looping_lines[name].setVisible(True)
+
         for name in self._plots.keys():
             self.update_plot(name)
+        self._dirty_plots.clear()
 
         for plot in self._qtgraphs.values():
             plot.setMouseEnabled(x=False, y=False)
@@ -315,6 +515,7 @@ class DataFiller():
         autoRange() used to set X range, then
         custom values used for Y range.
         '''
+        self._y_ranges.clear()
         for name, plot in self._qtgraphs.items():
             self.set_default_x_range(name)
             self.set_default_y_range(name)
@@ -326,11 +527,22 @@ class DataFiller():
         '''
 
         if name in self._monitors:
-            last_data_idx = self._looping_data_idx[name] - 1 if self._looping else -1
-            self._monitors[name].update_value(self._data[name][last_data_idx])
+            self._monitors[name].update_value(self._data.last(name))
         else:
             return
 
+    def update_breath_monitors(self, breath):
+        '''
+        Shows the metrics of a completed breath in the monitors
+        listed in breath_monitors
+
+        arguments:
+        - breath: the Breath from the BreathAnalyzer
+        '''
+
+        for name, monitor in self._breath_monitors.items():
+            monitor.update_value(getattr(breath, self._breath_fields[name]))
+
     def parse_color(self, rgb_string):
 
         color = rgb_string.replace('rgb', '')
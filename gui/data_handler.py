@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 import sys
+import time
 import datetime
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QTimer, QSocketNotifier
 from messagebox import MessageBox
+from communication.esp32serial import ESP32Exception, STALL_PERIODS
+from recorder import Recorder
+from blackbox import BlackBox
 
 class DataHandler():
     '''
@@ -10,27 +14,85 @@ class DataHandler():
     is entirey dedicated to read data from the ESP32.
     '''
 
-    def __init__(self, config, esp32, data_filler, gui_alarm):
+    def __init__(self, config, esp32, dispatcher, data_filler, gui_alarm):
         '''
         Initializes this class by creating a new QTimer
 
         arguments:
         - config: the config dictionary
         - esp32: the esp32serial instance
+        - dispatcher: the ESP32Dispatcher running the ESP requests
         - data_filler: the instance to the DataFiller class 
         - gui_alarm: the alarm class
         '''
 
         self._config = config
         self._esp32 = esp32
+        self._dispatcher = dispatcher
+        self._request = None
         self._data_f = data_filler
         self._gui_alarm = gui_alarm
 
+        self._fields = self._config['get_all_fields']
+
+        # Every sample is recorded on disk, if a directory is configured
+        self.recorder = None
+        if self._config.get('recorder_path'):
+            self.recorder = Recorder(self._config)
+
+        # The last samples are kept, to be saved when an alarm starts
+        self.blackbox = None
+        if self._config.get('blackbox_path'):
+            self.blackbox = BlackBox(self._config)
+
+        # In streaming mode the ESP pushes the samples, and the QTimer
+        # only drains what was received in the meanwhile
+        self._streaming = (self._config.get('use_streaming', False) and
+                           'stream' in self._esp32.protocol)
+
+        # In notifier mode the samples are processed as soon as they
+        # arrive on the serial port, without reader thread; the QTimer
+        # only checks that they keep coming
+        self._notifier = None
+        if self._streaming and self._config.get('acquisition_mode') == 'notifier':
+            self._make_notifier()
+
+        # A stalled stream is asked for again, at most once every
+        # STALL_PERIODS, and reported once silent for comm_error_timeout
+        self._resume = None
+        self._resumed_at = 0.
+
         self._timer = QTimer()
         self._timer.timeout.connect(self.esp32_io)
+
+        # if the ESP does not start streaming, Retry starts it again
+        if self._streaming:
+            try:
+                self._esp32.start_streaming(self._config['sampling_interval'],
+                                            reader=self._notifier is None)
+            except ESP32Exception as error:
+                self._comm_error(error)
+                return
+
         self._start_timer()
 
 
+    def _make_notifier(self):
+        '''
+        Watches the file descriptor of the serial port, which changes
+        when the port is reopened
+        '''
+        if self._notifier is not None:
+            self._notifier.setEnabled(False)
+            self._notifier.deleteLater()
+            self._notifier = None
+
+        fd = self._esp32.fileno()
+        if fd is not None:
+            self._notifier = QSocketNotifier(fd, QSocketNotifier.Read)
+            self._notifier.setEnabled(False)
+            self._notifier.activated.connect(self._data_ready)
+
     def __del__(self):
         '''
         Destructor
@@ -43,40 +105,123 @@ class DataHandler():
     def esp32_io(self):
         '''
         This is the main function that runs every time a QTimer times out.
-        It runs the get_all to get the data from the ESP.
+        It queues a get_all to get the data from the ESP, or collects
+        the samples streamed by the ESP since the last call.
+        '''
+
+        if self._streaming:
+            # the stream buffer is filled by the reader thread,
+            # draining it does not touch the serial line
+            try:
+                samples = self._esp32.drain_stream()
+            except Exception as error:
+                self._comm_error(error)
+                return
+            if not len(samples):
+                self._check_stream()
+            self._process(samples)
+            return
+
+        # don't pile up requests if the ESP is slower than the timer
+        if self._request is not None and not self._request.done():
+            return
+
+        self._request = self._dispatcher.submit(
+                self._dispatcher.PRIORITY_TELEMETRY,
+                self._esp32.get_all_values,
+                callback=lambda values: self._process([values]),
+                errback=self._comm_error)
+
+    def _check_stream(self):
+        '''
+        Asks the ESP to stream again if no sample came for a few
+        periods, e.g. because it was reset, and shows the
+        communication error if none came for comm_error_timeout.
+        '''
+        stalled = self._esp32.stream_stalled_for()
+        if not stalled:
+            return
+
+        if stalled >= self._config['comm_error_timeout']:
+            self._comm_error(ESP32Exception("stream", "stream on",
+                                            "no sample for %.1f s" % stalled))
+        elif ((self._resume is None or self._resume.done()) and
+                time.monotonic() - self._resumed_at >
+                STALL_PERIODS * self._config['sampling_interval']):
+            self._resumed_at = time.monotonic()
+            print('NORMAL: no sample for %.1f s, resuming the stream' % stalled)
+            self._resume = self._dispatcher.submit(
+                    self._dispatcher.PRIORITY_TELEMETRY,
+                    self._esp32.resume_streaming,
+                    errback=lambda error: print('Ignoring ESP error:', error))
+
+    def _data_ready(self):
+        '''
+        Called by the QSocketNotifier when the serial port is readable,
+        in notifier mode. Processes the samples received.
         '''
 
         try:
-            # Get all params from ESP
-            current_values = self._esp32.get_all()
+            self._esp32.pump_stream()
+            samples = self._esp32.drain_stream()
+        except Exception as error:
+            self._comm_error(error)
+            return
+        self._process(samples)
 
-            # Converting from str to float
-            for p, v in current_values.items():
-                current_values[p] = float(v)
+    def _process(self, samples):
+        '''
+        Passes the samples received from the ESP to the alarms and
+        to the DataFiller.
+
+        arguments:
+        - samples: the values, one row per sample in get_all_fields order
+        '''
 
-            current_values = self._convert_values(current_values)
+        try:
+            # the DataFiller stores the whole block and converts it
+            samples = self._data_f.add_samples(samples)
 
-            self._gui_alarm.set_data(current_values)
+            if self.recorder is not None:
+                self.recorder.add_samples(samples)
 
-            # finally, send values to the DataFiller
-            for p, v in current_values.items():
+            if self.blackbox is not None:
+                self.blackbox.add_samples(samples)
 
-                # print('Got data at time', datetime.datetime.now(), '=>', parameter, data)
-                self._data_f.add_data_point(p, v)
+            # the whole block is checked at once
+            self._gui_alarm.set_samples(samples)
 
         except Exception as error:
-            self.open_comm_error(str(error))
+            self._comm_error(error)
 
-    def _convert_values(self, values):
+    def close(self):
         '''
+        Stops the acquisition and commits the recorded samples to disk.
         '''
+        self._stop_timer()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.blackbox is not None:
+            self.blackbox.close()
+            self.blackbox = None
+
+    def _comm_error(self, error):
+        '''
+        Stops the acquisition and shows the communication error.
+        Acquisition restarts if the user clicks on retry.
+        A failed request is ignored as long as the ESP has not been
+        silent for longer than comm_error_timeout, unless the stream
+        stopped: only Retry starts it again.
+        '''
+        stopped = self._streaming and not self._esp32.streaming
+        if (isinstance(error, ESP32Exception) and not stopped and
+                self._esp32.link_down_for() < self._config['comm_error_timeout']):
+            print('Ignoring ESP error:', error)
+            return
 
-        conv = self._config['conversions']
-        return {k:v * conv.get(k, 1.) for (k, v) in values.items()}
-        # for n, v in values.items():
-        #     values[n] = v * conv['pressure'] if 'pressure' in conv else v
-
-
+        self._stop_timer()
+        self.open_comm_error(str(error))
 
     def open_comm_error(self, error):
         '''
@@ -85,7 +230,7 @@ class DataHandler():
         msg = MessageBox()
 
         # TODO: find a good exit point
-        callbacks = {msg.Retry: self._restart_timer,
+        callbacks = {msg.Retry: self._retry,
                      msg.Abort: lambda: sys.exit(-1)}
 
         fn = msg.critical("COMMUNICATION ERROR",
@@ -96,16 +241,49 @@ class DataHandler():
         fn()
 
 
+    def _retry(self):
+        '''
+        Restarts the acquisition after a communication error. In
+        streaming mode the ESP is asked to stream again, after the
+        serial port is reopened if it failed.
+        '''
+        if not self._streaming:
+            self._restart_timer()
+            return
+
+        notifier = self._notifier is not None
+
+        def restarted(result):
+            if notifier:
+                self._make_notifier()
+            self._restart_timer()
+
+        self._dispatcher.submit(
+                self._dispatcher.PRIORITY_TELEMETRY,
+                lambda: self._esp32.restart_streaming(reader=not notifier),
+                callback=restarted,
+                errback=lambda error: self.open_comm_error(str(error)))
+
     def _start_timer(self):
         '''
-        Starts the QTimer.
+        Starts the QTimer, and enables the QSocketNotifier in notifier
+        mode.
         '''
-        self._timer.start(self._config["sampling_interval"] * 1000)
+        if self._notifier is not None:
+            self._notifier.setEnabled(True)
+
+        if self._streaming:
+            interval = self._config["stream_drain_interval"]
+        else:
+            interval = self._config["sampling_interval"]
+        self._timer.start(int(interval * 1000))
 
     def _stop_timer(self):
         '''
-        Stops the QTimer.
+        Stops the QTimer, or disables the QSocketNotifier.
         '''
+        if self._notifier is not None:
+            self._notifier.setEnabled(False)
         self._timer.stop()
 
     def _restart_timer(self):
@@ -113,17 +291,53 @@ class DataHandler():
         Restarts the QTimer if the QTimer is active,
         or simply starts the QTimer
         '''
-        if self._timer.isActive():
+        if self._timer.isActive() or self._notifier is not None:
             self._stop_timer()
 
         self._start_timer()
 
-    def set_data(self, param, value):
+    def set_data(self, param, value, callback=None, errback=None):
         '''
-        Sets data to the ESP
+        Sets data to the ESP. The request is executed by the
+        dispatcher thread.
+
+        arguments:
+        - param: the ESP parameter name
+        - value: the value to set
+        - callback: called with True if the ESP acknowledged the value
+        - errback: called with the exception in case of failure
+
+        returns: a Future for the success status
+        '''
+
+        def set_and_check():
+            result = self._esp32.set(param, value)
+            return result == self._config['return_success_code']
+
+        return self._dispatcher.submit(self._dispatcher.PRIORITY_SETTINGS,
+                                       set_and_check,
+                                       callback=callback, errback=errback)
+
+    def set_data_batch(self, values, callback=None, errback=None):
+        '''
+        Sets several values to the ESP in a single batch. The
+        request is executed by the dispatcher thread.
+
+        arguments:
+        - values: a list of (ESP parameter name, value) pairs
+        - callback: called with a list of success statuses, one per value
+        - errback: called with the exception in case of failure
+
+        returns: a Future for the list of success statuses
         '''
 
-        result = self._esp32.set(param, value)
+        def set_and_check():
+            with self._esp32.batch() as batch:
+                replies = [batch.set(param, value) for param, value in values]
+            return [reply.result() == self._config['return_success_code']
+                    for reply in replies]
 
-        return result == self._config['return_success_code']
+        return self._dispatcher.submit(self._dispatcher.PRIORITY_SETTINGS,
+                                       set_and_check,
+                                       callback=callback, errback=errback)
 
@@ -0,0 +1,187 @@
+'''
+Reduces the plotted series to about as many points as the plot has
+pixels.
+'''
+
+import numpy as np
+
+
+class Decimator():
+    '''
+    Decimates a circular buffer of 'size' values into 'points' points.
+
+    The buffer is split in buckets of consecutive positions (in
+    storage order), and each bucket is reduced to:
+    - 'minmax': its minimum and its maximum, in their order, so the
+      envelope of the series is kept
+    - 'lttb': the point making the largest triangle with the point
+      chosen in the previous bucket and the mean of the next one
+      (Largest Triangle Three Buckets). The neighbours are taken in
+      time order: not across the head, where the newest values meet
+      the oldest ones.
+
+    The reduced buckets are kept: update() only recomputes the buckets
+    written since the previous call. The bucket holding the head mixes
+    the newest and the oldest values, so it is shown as two partial
+    buckets, recomputed at every update.
+    '''
+
+    def __init__(self, size, points, method='minmax'):
+        '''
+        Constructor
+
+        arguments:
+        - size: the number of values in the buffer
+        - points: the number of points to reduce them to, at least 2
+        - method: 'minmax' or 'lttb'
+        '''
+
+        if method not in ('minmax', 'lttb'):
+            raise ValueError('Unknown decimation method %s' % method)
+
+        self.size = size
+        self.points = max(points, 2)
+        self.method = method
+
+        # points per bucket, and values per bucket
+        self._k = 2 if method == 'minmax' else 1
+        self.bucket = max(-(-size * self._k // self.points), 1)
+        self._n_buckets = -(-size // self.bucket)
+
+        self._index = np.zeros((self._n_buckets, self._k), dtype=int)
+        self._values = np.zeros((self._n_buckets, self._k))
+
+        self._raw = None
+        self._head = 0
+        self._count = None
+
+    def update(self, raw, head, count):
+        '''
+        Recomputes the buckets written since the previous call
+
+        arguments:
+        - raw: the buffer values in storage order
+        - head: the position where the next value goes
+        - count: the number of values appended to the buffer so far
+        '''
+
+        self._raw = raw
+        self._head = head
+        if self._count is None or count - self._count >= self.size:
+            # from the oldest, so each bucket follows its previous one
+            dirty = (np.arange(self._n_buckets) + head // self.bucket) % self._n_buckets
+        else:
+            new = count - self._count
+            first = (head - new) % self.size // self.bucket
+            last = (head - 1) % self.size // self.bucket
+            if new == 0:
+                dirty = []
+            elif first <= last:
+                dirty = range(first, last + 1)
+            else:
+                dirty = list(range(first, self._n_buckets)) + list(range(last + 1))
+
+        for j in dirty:
+            start = j * self.bucket
+            self._index[j], self._values[j] = self._reduce(start, start + self.bucket, j)
+
+        self._count = count
+
+    def _reduce(self, start, stop, j):
+        '''
+        Reduces the values at positions [start, stop) of bucket j
+
+        returns: the positions and the values of the points kept
+        '''
+
+        stop = min(stop, self.size)
+        values = self._raw[start:stop]
+
+        if self.method == 'minmax':
+            lo = start + np.argmin(values)
+            hi = start + np.argmax(values)
+            index = np.array([lo, hi]) if lo <= hi else np.array([hi, lo])
+            return index, self._raw[index]
+
+        # the x are the ages of the values, from the oldest one
+        x = (np.arange(start, stop) - self._head) % self.size
+
+        # the previous chosen point, and the mean of the next bucket,
+        # if they come before and after in time; the bucket ends
+        # otherwise
+        prev = self._index[j - 1, 0]
+        if (prev - self._head) % self.size < x[0]:
+            x0, y0 = (prev - self._head) % self.size, self._raw[prev]
+        else:
+            x0, y0 = x[0], values[0]
+        following = min(self.bucket, self.size - 1 - x[-1])
+        if following:
+            x1 = x[-1] + 1 + (following - 1) / 2.
+            y1 = self._raw[(stop + np.arange(following)) % self.size].mean()
+        else:
+            x1, y1 = x[-1], values[-1]
+
+        area = np.abs((x0 - x1) * (values - y0) - (x0 - x) * (y1 - y0))
+        index = np.array([start + np.argmax(area)])
+        return index, self._raw[index]
+
+    def _parts(self):
+        '''
+        Returns the head bucket, and its newest and oldest parts as
+        (positions, values) pairs, None where a part is empty
+        '''
+
+        j = self._head // self.bucket
+        start = j * self.bucket
+        newest = oldest = None
+        if self._head > start:
+            newest = self._reduce(start, self._head, j)
+            if self._head < min(start + self.bucket, self.size):
+                oldest = self._reduce(self._head, start + self.bucket, j)
+        return j, newest, oldest
+
+    def _join(self, buckets, first=None, last=None):
+        '''
+        Concatenates the points of some buckets, between two optional
+        partial buckets
+        '''
+
+        index = [self._index[buckets].ravel()]
+        values = [self._values[buckets].ravel()]
+        if first is not None:
+            index.insert(0, first[0])
+            values.insert(0, first[1])
+        if last is not None:
+            index.append(last[0])
+            values.append(last[1])
+        return np.concatenate(index), np.concatenate(values)
+
+    def looping(self):
+        '''
+        Returns the points in storage order, as the positions of the
+        values in the buffer and the values
+        '''
+
+        j, newest, oldest = self._parts()
+        if newest is None:
+            return self._join(np.arange(self._n_buckets))
+
+        before = self._join(np.arange(j), last=newest)
+        after = self._join(np.arange(j + 1, self._n_buckets), first=oldest)
+        return (np.concatenate([before[0], after[0]]),
+                np.concatenate([before[1], after[1]]))
+
+    def scrolling(self):
+        '''
+        Returns the points from the oldest to the newest, as the
+        indexes of the values from the oldest one, and the values
+        '''
+
+        j, newest, oldest = self._parts()
+        if newest is None:
+            order = (np.arange(self._n_buckets) + j) % self._n_buckets
+            index, values = self._join(order)
+        else:
+            order = (np.arange(1, self._n_buckets) + j) % self._n_buckets
+            index, values = self._join(order, first=oldest, last=newest)
+        return (index - self._head) % self.size, values
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import time
+from PyQt5 import QtWidgets, uic
+from PyQt5 import QtCore, QtGui
+
+from journal import KINDS
+
+
+class JournalModel(QtCore.QAbstractTableModel):
+    '''
+    Shows the events of a Journal, the newest first, optionally only
+    the ones of a kind.
+
+    The view only asks for the rows it displays, which are read from
+    the journal file then: scrolling costs the same whatever the
+    number of events.
+    '''
+
+    COLUMNS = ('Time', 'Event', 'Details')
+
+    LABELS = {
+        'alarm': 'Alarm',
+        'alarm_clear': 'Alarm cleared',
+        'warning': 'Warning',
+        'warning_clear': 'Warning cleared',
+        'snooze': 'Snoozed',
+        'setting': 'Setting',
+        'start': 'Start',
+        'stop': 'Stop',
+        'mode': 'Mode',
+    }
+
+    COLORS = {
+        'alarm': QtGui.QColor('red'),
+        'warning': QtGui.QColor('darkorange'),
+    }
+
+    def __init__(self, journal, parent=None):
+        '''
+        Constructor
+
+        arguments:
+        - journal: the Journal
+        - parent: the parent QObject
+        '''
+        super(JournalModel, self).__init__(parent)
+        self._journal = journal
+        self._kind = None
+        self._rows = None
+        self._count = len(journal)
+        journal.subscribe(self._added)
+
+    def set_kind(self, kind):
+        '''
+        Shows only the events of a kind, or all of them if None
+        '''
+        self.beginResetModel()
+        self._kind = kind
+        self._rows = None if kind is None else self._journal.rows(kind)
+        self._count = len(self._journal if kind is None else self._rows)
+        self.endResetModel()
+
+    def _added(self, row):
+        '''
+        Inserts an event added to the journal on top, if shown
+        '''
+        if self._kind is not None and self._journal.kind(row) != self._kind:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), 0, 0)
+        self._count += 1
+        self.endInsertRows()
+
+    def journal_row(self, row):
+        '''
+        returns: the journal row of a model row
+        '''
+        index = self._count - 1 - row
+        return index if self._rows is None else self._rows[index]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self._count
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == QtCore.Qt.DisplayRole:
+            entry = self._journal.entry(self.journal_row(index.row()))
+            if index.column() == 0:
+                return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.time))
+            if index.column() == 1:
+                return self.LABELS[entry.kind]
+            return entry.text
+        if role == QtCore.Qt.ForegroundRole:
+            return self.COLORS.get(self._journal.kind(self.journal_row(index.row())))
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+
+class EventLog(QtWidgets.QWidget):
+    def __init__(self, *args):
+        """
+        Initialize the EventLog page, listing the journal events.
+
+        Grabs child widgets.
+        """
+        super(EventLog, self).__init__(*args)
+        uic.loadUi("eventlog/eventlog.ui", self)
+
+        self.combo_kind.addItem('All events', None)
+        for kind in KINDS:
+            self.combo_kind.addItem(JournalModel.LABELS[kind], kind)
+
+        # fixed row heights, so the view never measures the rows
+        # outside the visible ones
+        header = self.table_events.verticalHeader()
+        header.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        header.setDefaultSectionSize(self.table_events.fontMetrics().height() + 8)
+        header.hide()
+
+        header = self.table_events.horizontalHeader()
+        header.setSectionResizeMode(QtWidgets.QHeaderView.Interactive)
+        header.setStretchLastSection(True)
+
+    def connect_journal(self, journal):
+        '''
+        Shows the events of a Journal
+        '''
+        self._model = JournalModel(journal, self)
+        self.table_events.setModel(self._model)
+        self.table_events.setColumnWidth(0, 200)
+        self.table_events.setColumnWidth(1, 160)
+        self.combo_kind.currentIndexChanged.connect(
+            lambda index: self._model.set_kind(self.combo_kind.itemData(index)))
@@ -34,16 +34,14 @@ class Cursor:
             self.cursor_y[num] = InfiniteLine(angle=0, movable=False)
             plot.addItem(self.cursor_x[num], ignoreBounds=True)
             plot.addItem(self.cursor_y[num], ignoreBounds=True)
-            self.signal_proxy[num] = SignalProxy(plot.scene().sigMouseMoved,
-                    rateLimit=60, slot=self.update_cursor)
 
             self.cursor_label[num] = TextItem('', (255, 255, 255), anchor=(0, 0))
             self.cursor_label[num].setPos(-10.4, 10)
             plot.addItem(self.cursor_label[num])
 
-            # Find the PlotDataItem displaying data
+            # Find the PlotDataItem displaying the frozen data
             for item in plot.getPlotItem().items:
-                if isinstance(item, PlotDataItem):
+                if isinstance(item, PlotDataItem) and item.name() == 'frozen':
                     self.plot_data_items[num] = item
 
         self.hide_cursors()
@@ -51,8 +49,12 @@ class Cursor:
     def show_cursors(self):
         '''
         Shows all the cursor lines and labels 
-        on the 3 plots
+        on the 3 plots, and starts following the mouse
         '''
+        for num, plot in enumerate(self.plots):
+            if self.signal_proxy[num] is None:
+                self.signal_proxy[num] = SignalProxy(plot.scene().sigMouseMoved,
+                        rateLimit=60, slot=self.update_cursor)
         for c in self.cursor_x:     c.setVisible(True)
         for c in self.cursor_y:     c.setVisible(True)
         for c in self.cursor_label: c.setVisible(True)
@@ -60,8 +62,12 @@ class Cursor:
     def hide_cursors(self):
         '''
         Hides all the cursor lines and labels 
-        on the 3 plots
+        on the 3 plots, and stops following the mouse
         '''
+        for num, proxy in enumerate(self.signal_proxy):
+            if proxy is not None:
+                proxy.disconnect()
+                self.signal_proxy[num] = None
         for c in self.cursor_x:     c.setVisible(False)
         for c in self.cursor_y:     c.setVisible(False)
         for c in self.cursor_label: c.setVisible(False)
@@ -92,9 +98,15 @@ class Cursor:
                 # Get the x and y data from the plot
                 data_x = self.plot_data_items[num].xData
                 data_y = self.plot_data_items[num].yData
-
-                # Find the x index closest to where the mouse if pointing
-                index = (np.abs(data_x - mousePoint.x())).argmin()
+                if data_x is None or not len(data_x):
+                    continue
+
+                # Find the x index closest to where the mouse if pointing,
+                # the x data being sorted
+                index = np.searchsorted(data_x, mousePoint.x())
+                if index == len(data_x) or (index > 0 and
+                        mousePoint.x() - data_x[index - 1] < data_x[index] - mousePoint.x()):
+                    index -= 1
 
                 if index > 0 and index < len(data_y):
                     self._x[num] = mousePoint.x()
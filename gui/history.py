@@ -0,0 +1,160 @@
+'''
+Loads the history of the observables for the frozen plots.
+'''
+
+import numpy as np
+
+
+# the recorded samples are reduced a stride of about this many samples
+# at a time, so the memory used does not depend on the time range
+STRIDE = 65536
+
+
+def _minmax(times, values, bucket):
+    '''
+    Keeps the minimum and the maximum of each bucket of 'bucket'
+    consecutive samples, in order, the last bucket possibly shorter
+    '''
+
+    if bucket <= 1:
+        return times, values
+
+    n = len(values) // bucket * bucket
+    rows = values[:n].reshape(-1, bucket)
+    start = np.arange(0, n, bucket)
+    lo = start + rows.argmin(axis=1)
+    hi = start + rows.argmax(axis=1)
+    if n < len(values):
+        # the last samples, fewer than a bucket
+        lo = np.append(lo, n + values[n:].argmin())
+        hi = np.append(hi, n + values[n:].argmax())
+    index = np.sort(np.stack([lo, hi], axis=1), axis=1).ravel()
+    return times[index], values[index]
+
+
+def envelope(times, values, points):
+    '''
+    Reduces a series to at most 'points' points, keeping the minimum
+    and the maximum of each bucket of consecutive samples, in order.
+
+    arguments:
+    - times, values: the series, as arrays
+    - points: the maximum number of points
+
+    returns: the reduced times and values
+    '''
+
+    return _minmax(times, values, -(-len(values) * 2 // max(points, 2)))
+
+
+def envelope_chunks(chunks, points):
+    '''
+    Same as envelope(), for a series split in chunks (e.g. the views
+    on the recorder segments), each one reduced a stride at a time
+    without copying it whole.
+
+    arguments:
+    - chunks: a list of (times, values) pairs, in order
+    - points: the maximum number of points, about
+
+    returns: the reduced times and values, as arrays
+    '''
+
+    total = sum(len(values) for _, values in chunks)
+    bucket = max(-(-total * 2 // max(points, 2)), 1)
+    step = max(STRIDE // bucket, 1) * bucket
+
+    parts = []
+    for times, values in chunks:
+        for first in range(0, len(values), step):
+            parts.append(_minmax(times[first:first + step],
+                                 values[first:first + step].astype(float), bucket))
+
+    if not parts:
+        return np.empty(0), np.empty(0)
+    return (np.concatenate([t for t, _ in parts]),
+            np.concatenate([v for _, v in parts]))
+
+
+class History():
+    '''
+    Finds the values of an observable over a time range, at a
+    resolution matched to the number of points to display:
+    - from the samples recorded on disk, if a Recorder is connected
+      and the range holds at most max_raw_factor samples per point,
+      reduced to their envelope
+    - otherwise from the recent samples, and before them from the
+      TrendStore level matching the range (min and max of each period)
+    - if the TrendStore does not cover the range either (e.g. just
+      after a restart), from the recorded samples anyway.
+
+    The recorded samples are reduced a stride at a time, so the memory
+    used depends on the plot width, not on the length of the range.
+    '''
+
+    # the widest range read from the recorder, in samples per point
+    max_raw_factor = 16
+
+    def __init__(self, trends, recorder=None):
+        '''
+        Constructor
+
+        arguments:
+        - trends: the TrendStore
+        - recorder: the Recorder, if any
+        '''
+
+        self.trends = trends
+        self.recorder = recorder
+
+    def load(self, field, start, end, points, recent=None):
+        '''
+        Returns the values of a field between two times
+
+        arguments:
+        - field: the field name
+        - start, end: the time range, in seconds since the epoch
+        - points: the number of points to return, about
+        - recent: the (times, values) of the last samples, if any,
+                  used where they cover the range
+
+        returns: the times and the values, as arrays
+        '''
+
+        chunks = []
+        if self.recorder is not None:
+            # views on the mapped segments, nothing is read yet
+            chunks = self.recorder.query(field, start, end)
+            if 0 < sum(len(t) for t, _ in chunks) <= self.max_raw_factor * points:
+                return envelope_chunks(chunks, points)
+
+        times, values = self._trends(field, start, end, points, recent)
+        if not len(times) and chunks:
+            return envelope_chunks(chunks, points)
+        return times, values
+
+    def _trends(self, field, start, end, points, recent):
+        '''
+        Returns the values of a field between two times, from the
+        recent samples and the TrendStore
+        '''
+
+        parts = []
+        recent_start = end
+        if recent is not None and len(recent[0]):
+            recent_start = max(recent[0][0], start)
+            first = np.searchsorted(recent[0], start)
+            stop = np.searchsorted(recent[0], end, side='right')
+            if first < stop:
+                parts.append(envelope(recent[0][first:stop], recent[1][first:stop], points))
+
+        if start < recent_start:
+            times, mins, maxs, _ = self.trends.query(field, start, recent_start, points // 2)
+            if len(times):
+                parts.insert(0, (np.repeat(times, 2),
+                                 np.stack([mins, maxs], axis=1).ravel()))
+
+        if not parts:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([t for t, _ in parts]),
+                np.concatenate([v for _, v in parts]))
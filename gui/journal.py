@@ -0,0 +1,251 @@
+'''
+Keeps an append-only journal of the alarms and of the operator and
+ventilator events, indexed by row, time and kind.
+'''
+
+import os
+import time
+import struct
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from threading import Thread, Lock, Event
+
+
+# Journal file layout: the magic, then one record per event: a header
+# (time as float64, kind, text length), the UTF-8 text and the CRC32
+# of both. A record with a bad CRC, and everything after it, is a torn
+# tail, discarded when the journal is opened again.
+JOURNAL_MAGIC = b'MVMJRN1\0'
+_RECORD = struct.Struct('<dBH')
+_CRC = struct.Struct('<I')
+
+# The kinds of event, stored as their index in this tuple: append new
+# kinds at the end only
+KINDS = ('alarm', 'alarm_clear', 'warning', 'warning_clear', 'snooze',
+         'setting', 'start', 'stop', 'mode')
+
+# An event: its time in seconds since the epoch, its kind (one of
+# KINDS) and a text
+Entry = namedtuple('Entry', ['time', 'kind', 'text'])
+
+
+class Journal():
+    '''
+    Appends the events to a journal file, and reads them back by row,
+    the row being the order they were added in.
+
+    Only the offset, time and kind of each record are kept in memory
+    (13 bytes per event, plus 4 in the index of its kind), the texts
+    are read from the file when asked for, so a long journal can be
+    browsed without loading it.
+
+    The records are handed to the operating system as they are added,
+    so they survive a crash of the GUI, and written to disk by a
+    syncing thread every journal_sync_interval seconds.
+
+    Example usage:
+
+    ```
+    journal.add('setting', 'peep = 5')
+    for row in journal.rows('alarm'):
+        print(journal.entry(row).text)
+    ```
+    '''
+
+    def __init__(self, config):
+        '''
+        Constructor
+
+        Opens the journal_path file, or creates it if it does not
+        exist, and starts the syncing thread. If journal_path is
+        empty, the journal is kept in a temporary file, for this
+        session only.
+
+        arguments:
+        - config: the config dictionary
+        '''
+
+        self.path = config.get('journal_path')
+        self._sync_interval = config.get('journal_sync_interval', 1)
+
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a+b')
+        else:
+            self._file = tempfile.TemporaryFile()
+        self._fd = self._file.fileno()
+
+        self._lock = Lock()
+        self._offsets = array('Q')
+        self._times = array('d')
+        self._kinds = array('B')
+        self._by_kind = {kind: array('L') for kind in KINDS}
+        self._subscribers = []
+        self._load()
+
+        self._dirty = False
+        self._stop = Event()
+        self._syncer = Thread(target=self._sync_loop, daemon=True)
+        self._syncer.start()
+
+    def _load(self):
+        '''
+        Indexes the records of the file, truncating it after the last
+        valid one
+        '''
+
+        self._file.seek(0)
+        data = self._file.read()
+        if not data:
+            self._file.write(JOURNAL_MAGIC)
+            self._file.flush()
+            self._size = len(JOURNAL_MAGIC)
+            return
+        if not data.startswith(JOURNAL_MAGIC):
+            raise ValueError('%s: not a journal' % self.path)
+
+        offset = len(JOURNAL_MAGIC)
+        while offset + _RECORD.size <= len(data):
+            when, kind, length = _RECORD.unpack_from(data, offset)
+            end = offset + _RECORD.size + length
+            if (end + _CRC.size > len(data) or kind >= len(KINDS) or
+                    _CRC.unpack_from(data, end)[0] != zlib.crc32(data[offset:end])):
+                break
+            self._index(offset, when, kind)
+            offset = end + _CRC.size
+
+        if offset < len(data):
+            print('NORMAL: Journal truncating torn tail of', self.path, 'at', offset)
+            self._file.truncate(offset)
+            self._file.flush()
+            os.fsync(self._fd)
+        self._size = offset
+
+    def _index(self, offset, when, kind):
+        '''
+        Indexes a record, by row, time and kind
+
+        arguments:
+        - offset: the offset of the record in the file
+        - when: the time of the event
+        - kind: the index of its kind in KINDS
+        '''
+        self._by_kind[KINDS[kind]].append(len(self._offsets))
+        self._offsets.append(offset)
+        self._times.append(when)
+        self._kinds.append(kind)
+
+    def subscribe(self, callback):
+        '''
+        Registers a function called with the row of each event added
+
+        arguments:
+        - callback: the function, called in the thread adding the event
+        '''
+        self._subscribers.append(callback)
+
+    def add(self, kind, text, now=None):
+        '''
+        Appends an event
+
+        arguments:
+        - kind: the kind of event, one of KINDS
+        - text: what happened
+        - now: the time of the event, default time.time()
+
+        returns: the row of the event
+        '''
+
+        if now is None:
+            now = time.time()
+        payload = text.encode('utf-8')[:0xffff]
+        record = _RECORD.pack(now, KINDS.index(kind), len(payload)) + payload
+        record += _CRC.pack(zlib.crc32(record))
+
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            self._dirty = True
+            row = len(self._offsets)
+            self._index(self._size, now, KINDS.index(kind))
+            self._size += len(record)
+
+        for callback in self._subscribers:
+            callback(row)
+        return row
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def entry(self, row):
+        '''
+        Reads an event back
+
+        arguments:
+        - row: the row of the event
+
+        returns: the Entry
+        '''
+
+        offset = self._offsets[row]
+        header = os.pread(self._fd, _RECORD.size, offset)
+        when, kind, length = _RECORD.unpack(header)
+        text = os.pread(self._fd, length, offset + _RECORD.size)
+        return Entry(when, KINDS[kind], text.decode('utf-8', 'replace'))
+
+    def time(self, row):
+        '''
+        returns: the time of an event, in seconds since the epoch,
+        without reading the file
+        '''
+        return self._times[row]
+
+    def kind(self, row):
+        '''
+        returns: the kind of an event, without reading the file
+        '''
+        return KINDS[self._kinds[row]]
+
+    def find(self, when):
+        '''
+        returns: the row of the first event at or after a time, in
+        seconds since the epoch (the number of events if none)
+        '''
+        return bisect_left(self._times, when)
+
+    def rows(self, kind):
+        '''
+        returns: the rows of the events of a kind, in order, as an
+        array growing as these events are added (do not modify it)
+        '''
+        return self._by_kind[kind]
+
+    def _sync_loop(self):
+        '''
+        The body of the syncing thread. The lock is not held while
+        syncing, which can be slow (e.g. on an SD card), so that
+        add() never waits for it.
+        '''
+
+        while not self._stop.wait(self._sync_interval):
+            with self._lock:
+                dirty, self._dirty = self._dirty, False
+            if dirty:
+                os.fsync(self._fd)
+
+    def close(self):
+        '''
+        Stops the syncing thread and writes the pending records
+        '''
+
+        self._stop.set()
+        self._syncer.join()
+        with self._lock:
+            if self._dirty:
+                os.fsync(self._fd)
+            self._file.close()
@@ -0,0 +1,127 @@
+'''
+A looping plot curve, redrawn only where new samples were written.
+'''
+
+import numpy as np
+
+
+class LoopingCurve():
+    '''
+    Draws a series kept in storage order (the newest sample at head - 1,
+    the oldest at head) as several curve items, each one covering a
+    fixed range of positions and sharing its last point with the next
+    one. When samples are written, only the items covering them are
+    redrawn, so pyqtgraph rebuilds the paths of these items only.
+
+    The newest and the oldest samples are not joined: a NaN is
+    inserted between them, and the curves skip it (connect='finite').
+    '''
+
+    def __init__(self, plot, pen, size, segments):
+        '''
+        Constructor
+
+        arguments:
+        - plot: the PlotWidget to draw in
+        - pen: the pen of the curves
+        - size: the number of positions in the series
+        - segments: the number of curve items
+        '''
+
+        self.size = size
+        segments = max(min(segments, size), 1)
+        self._bounds = np.linspace(0, size, segments + 1).astype(int)
+        self._items = [plot.plot(pen=pen, connect='finite') for _ in range(segments)]
+        self._positions = np.arange(size)
+        self._head = 0
+        self._count = None
+
+    def setData(self, x, y, head=None):
+        '''
+        Draws a whole series at once, as PlotDataItem.setData. The
+        next update() redraws everything.
+
+        arguments:
+        - x: the x coordinate of each position
+        - y: the values, in storage order
+        - head: the position where the next value goes, default the
+                one of the last update()
+        '''
+
+        if head is not None:
+            self._head = head
+
+        for segment in range(len(self._items)):
+            self._draw(segment, x, self._positions, y)
+        self.invalidate()
+
+    def setVisible(self, visible):
+        '''
+        Shows or hides all the curve items
+        '''
+        for item in self._items:
+            item.setVisible(visible)
+
+    def invalidate(self):
+        '''
+        Makes the next update() redraw all the curve items
+        '''
+        self._count = None
+
+    def update(self, x, positions, values, head, count, spread=0):
+        '''
+        Redraws the curve items covering the positions written since
+        the previous call, the one before them (it ends on their first
+        point) and the one holding the head (where the gap moved)
+
+        arguments:
+        - x: the x coordinate of each position
+        - positions: the positions of the values to draw, in
+                     increasing order (all of them, or a decimation)
+        - values: the values at these positions
+        - head: the position where the next value goes
+        - count: the number of values written so far
+        - spread: how far from the written positions the points may
+                  have changed (the bucket size of a decimation)
+        '''
+
+        self._head = head
+        if self._count is None or count - self._count + 2 * spread >= self.size:
+            dirty = range(len(self._items))
+        else:
+            new = count - self._count
+            first = (self._segment((head - new - spread) % self.size) - 1) % len(self._items)
+            last = self._segment((head + spread) % self.size)
+            if new == 0:
+                dirty = []
+            elif first <= last:
+                dirty = range(first, last + 1)
+            else:
+                dirty = list(range(first, len(self._items))) + list(range(last + 1))
+
+        for segment in dirty:
+            self._draw(segment, x, positions, values)
+        self._count = count
+
+    def _segment(self, position):
+        return np.searchsorted(self._bounds, position, side='right') - 1
+
+    def _draw(self, segment, x, positions, values):
+        '''
+        Sets the data of a curve item, from the points of the series
+        between its bounds, and the first point of the next one
+        '''
+
+        start, stop = np.searchsorted(positions, self._bounds[segment:segment + 2])
+        stop = min(stop + 1, len(positions))
+        positions = positions[start:stop]
+        values = values[start:stop]
+        xs = x[positions]
+
+        # break the curve between the newest and the oldest sample
+        cut = np.searchsorted(positions, self._head)
+        if 0 < cut < len(positions):
+            xs = np.insert(xs, cut, x[self._head])
+            values = np.insert(values, cut, np.nan)
+
+        self._items[segment].setData(xs, values)
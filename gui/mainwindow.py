@@ -24,13 +24,15 @@ from alarm_handler import AlarmHandler
 from controller_status import ControllerStatus
 from numpad.numpad import NumPad
 from frozenplots.frozenplots import Cursor
+from eventlog.eventlog import EventLog
+from journal import Journal
 
 import pyqtgraph as pg
 import sys
 import time
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, config, esp32, *args, **kwargs):
+    def __init__(self, config, esp32, dispatcher, *args, **kwargs):
         """
         Initializes the main window for the MVM GUI. See below for subfunction setup description.
         """
@@ -40,13 +42,21 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.config = config
         self.esp32 = esp32
+        self.dispatcher = dispatcher
         settings_file = SettingsFile(self.config["settings_file_path"])
         self.user_settings = settings_file.load()
 
+        '''
+        Open the journal, where the alarms and the operator and
+        ventilator events are kept
+        '''
+        self.journal = Journal(self.config)
+
         '''
         Start the alarm handler, which will check for ESP alarms
         '''
-        self.alarm_h = AlarmHandler(self.config, self.esp32)
+        self.alarm_h = AlarmHandler(self.config, self.esp32, self.dispatcher,
+                                    self.journal)
 
         '''
         Get the toppane and child pages
@@ -137,6 +147,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.button_offalarm   = self.alarmsbar.findChild(QtWidgets.QPushButton, "button_offalarm")
 
         self.button_freeze       = self.specialbar.findChild(QtWidgets.QPushButton, "button_freeze")
+        self.button_eventlog     = self.specialbar.findChild(QtWidgets.QPushButton, "button_eventlog")
         self.button_backspecial  = self.specialbar.findChild(QtWidgets.QPushButton, "button_backspecial")
 
         '''
@@ -175,6 +186,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # Special
         self.button_freeze.pressed.connect(self.freeze_plots)
+        self.button_eventlog.pressed.connect(self.show_eventlog)
         self.button_unfreeze.pressed.connect(self.unfreeze_plots)
         self.button_backspecial.pressed.connect(self.show_menu)
 
@@ -239,7 +251,8 @@ class MainWindow(QtWidgets.QMainWindow):
         # for name in config['alarms']:
         #     alarm = GuiAlarm(name, config, self.monitors, self.alarm_h)
         #     self.alarms[name] = alarm
-        self.gui_alarm = GuiAlarms(config, self.esp32, self.monitors)
+        self.gui_alarm = GuiAlarms(config, self.esp32, self.dispatcher, self.monitors,
+                                   self.journal)
         for m in self.monitors.values(): m.connect_gui_alarm(self.gui_alarm)
 
 
@@ -253,6 +266,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.button_upalarm.pressed.connect(self.alarms_settings.move_selected_up)
         self.button_downalarm.pressed.connect(self.alarms_settings.move_selected_down)
 
+        # The event log page, listing the journal
+        self.eventlog = EventLog()
+        self.eventlog.connect_journal(self.journal)
+        self.centerpane.addWidget(self.eventlog)
+        self.eventlog.button_backeventlog.pressed.connect(self.show_plots)
+
         # Connect the frozen plots
         # Requires building of an ordered array to associate the correct controls with the plot.
         active_plots = []
@@ -269,7 +288,11 @@ class MainWindow(QtWidgets.QMainWindow):
         data directly to the DataFiller, which will
         then display them.
         '''
-        self._data_h = DataHandler(config, self.esp32, self.data_filler, self.gui_alarm)
+        self._data_h = DataHandler(config, self.esp32, self.dispatcher,
+                self.data_filler, self.gui_alarm)
+        self.data_filler.connect_recorder(self._data_h.recorder)
+        if self._data_h.blackbox is not None:
+            self._data_h.blackbox.connect_journal(self.journal)
 
         self.specialbar.connect_datahandler_config_esp32(self._data_h,
                 self.config, self.esp32)
@@ -295,7 +318,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.button_startstop,
                 self.button_autoassist,
                 self.toolbar,
-                self.settings)
+                self.settings,
+                self.journal)
 
         self.button_startstop.released.connect(self._start_stop_worker.toggle_start_stop)
         self.button_autoassist.released.connect(self._start_stop_worker.toggle_mode)
@@ -303,7 +327,8 @@ class MainWindow(QtWidgets.QMainWindow):
         '''
         Instantiate ControllerStatus
         '''
-        self._ctr_status = ControllerStatus(config, self.esp32, self.settings, self._start_stop_worker)
+        self._ctr_status = ControllerStatus(config, self.esp32, self.dispatcher,
+                self.settings, self._start_stop_worker)
 
     def lock_screen(self):
         self.toppane.setDisabled(True)
@@ -400,6 +425,9 @@ class MainWindow(QtWidgets.QMainWindow):
     def show_plots(self):
         self.centerpane.setCurrentWidget(self.plots_all)
 
+    def show_eventlog(self):
+        self.centerpane.setCurrentWidget(self.eventlog)
+
     def show_alarmsbar(self):
         self.bottombar.setCurrentWidget(self.alarmsbar)
 
@@ -414,3 +442,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.rightbar.setCurrentWidget(self.monitors_bar)
         self.show_specialbar()
 
+    def closeEvent(self, event):
+        '''
+        Stops the acquisition when the window is closed.
+        '''
+        self._data_h.close()
+        self.journal.close()
+        super().closeEvent(event)
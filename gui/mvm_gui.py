@@ -15,6 +15,8 @@ import yaml
 from mainwindow import MainWindow
 from communication.esp32serial import ESP32Serial
 from communication.fake_esp32serial import FakeESP32Serial
+from communication.esp32dispatcher import ESP32Dispatcher
+from communication.capture import ReplayConnection
 from messagebox import MessageBox
 
 def connect_esp32(config):
@@ -24,6 +26,22 @@ def connect_esp32(config):
             err_msg = "Cannot setup FakeESP32Serial"
             esp32 = FakeESP32Serial(config)
             esp32.set("wdenable", 1)
+        elif 'replayESP32' in sys.argv:
+            capture = sys.argv[sys.argv.index('replayESP32') + 1]
+            print('******* Replaying the ESP32 capture', capture)
+            err_msg = "Cannot replay %s" % capture
+            esp32 = ESP32Serial(config, connection=ReplayConnection(
+                capture, speed=config.get('replay_speed', 1)))
+            esp32.set("wdenable", 1)
+        elif 'emulateESP32' in sys.argv:
+            print('******* Emulating the ESP32 on a pseudo-terminal')
+            err_msg = "Cannot setup ESP32Emulator"
+            # Linux only, hence not imported at the top
+            from communication.esp32_emulator import ESP32Emulator
+            emulator = ESP32Emulator(config)
+            emulator.start()
+            esp32 = ESP32Serial(dict(config, port=emulator.port))
+            esp32.set("wdenable", 1)
         else:
             err_msg = "Cannot communicate with port %s" % config['port']
             esp32 = ESP32Serial(config)
@@ -55,12 +73,23 @@ if __name__ == "__main__":
     if esp32 is None:
         exit(-1)
 
+    # All the ESP accesses go through the dispatcher thread, except
+    # for the FakeESP32Serial, which is a widget and lives in the GUI
+    # thread.
+    dispatcher = ESP32Dispatcher(esp32,
+            threaded=not isinstance(esp32, FakeESP32Serial))
+
     watchdog = QtCore.QTimer()
-    watchdog.timeout.connect(esp32.set_watchdog)
+    watchdog.timeout.connect(lambda: dispatcher.submit(
+        dispatcher.PRIORITY_WATCHDOG, esp32.set_watchdog))
     watchdog.start(config["wdinterval"] * 1000)
 
-    window = MainWindow(config, esp32)
+    window = MainWindow(config, esp32, dispatcher)
     window.show()
     app.exec_()
+    window.close()
+    dispatcher.stop()
     esp32.set("wdenable", 0)
+    if isinstance(esp32, ESP32Serial):
+        esp32.close()
 
@@ -0,0 +1,332 @@
+'''
+Persists every sample received from the ESP to memory-mapped segment
+files, and answers time range queries on them.
+'''
+
+import os
+import mmap
+import json
+import glob
+import struct
+from threading import Thread, Lock, Event
+import numpy as np
+from sample_clock import SampleClock
+
+
+# Segment file layout: a header page, then 'capacity' fixed width
+# records (float64 time, then one float32 per get_all_fields value).
+# The header counts the records committed to disk: the ones after it
+# are a torn tail, discarded when the segment is opened again.
+SEGMENT_MAGIC = b'MVMREC1\0'
+_HEADER = struct.Struct('<8sIIQ')   # magic, fields count, capacity, committed
+_HEADER_SIZE = mmap.ALLOCATIONGRANULARITY
+
+# the sparse index keeps the time of one record every INDEX_STRIDE
+INDEX_STRIDE = 256
+
+
+class Segment():
+    '''
+    A preallocated segment file, memory-mapped as a numpy record array
+    '''
+
+    def __init__(self, path, fields, capacity):
+        '''
+        Constructor
+
+        Opens the segment, or creates it if it does not exist. The
+        records after the committed count are discarded.
+
+        arguments:
+        - path: the segment file
+        - fields: the field names, in the order of the sample values
+        - capacity: the number of records, for a new segment
+        '''
+
+        self.path = path
+        self.dtype = np.dtype([('time', '<f8'), ('values', '<f4', (len(fields),))])
+
+        header = json.dumps(fields).encode()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                magic, n_fields, capacity, committed = _HEADER.unpack(f.read(_HEADER.size))
+                names = f.read(_HEADER_SIZE - _HEADER.size).rstrip(b'\0')
+            if magic != SEGMENT_MAGIC or names != header:
+                raise ValueError('%s: not a segment for these fields' % path)
+        else:
+            committed = 0
+            with open(path, 'wb') as f:
+                f.write(_HEADER.pack(SEGMENT_MAGIC, len(fields), capacity, 0))
+                f.write(header)
+                f.truncate(_HEADER_SIZE + capacity * self.dtype.itemsize)
+
+        self.capacity = capacity
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.records = np.ndarray((capacity,), dtype=self.dtype,
+                                  buffer=self._map, offset=_HEADER_SIZE)
+
+        self.count = self._recover(min(committed, capacity))
+        self.committed = self.count
+        self.index = self.records['time'][:self.count:INDEX_STRIDE].copy()
+
+    def _recover(self, committed):
+        '''
+        Checks the committed records, dropping the invalid ones at
+        the end (their pages may not have reached the disk), and
+        clears everything after them.
+
+        returns: the number of valid records
+        '''
+
+        times = self.records['time']
+        while committed > 0 and not (
+                np.isfinite(times[committed - 1]) and times[committed - 1] > 0 and
+                (committed == 1 or times[committed - 1] >= times[committed - 2])):
+            committed -= 1
+
+        if committed < self.capacity and times[committed:].any():
+            print('NORMAL: Recorder truncating torn tail of', self.path, 'at', committed)
+            self.records[committed:] = np.zeros(1, dtype=self.dtype)
+            self._write_header(committed)
+            self._map.flush()
+        return committed
+
+    def _write_header(self, committed):
+        self._map[:_HEADER.size] = _HEADER.pack(SEGMENT_MAGIC, self.dtype['values'].shape[0],
+                                                self.capacity, committed)
+
+    @property
+    def full(self):
+        return self.count == self.capacity
+
+    def append(self, times, samples):
+        '''
+        Copies records into the mapped file. They are not on disk
+        until commit() is called.
+
+        returns: the number of records appended, less than the
+        samples if the segment is full
+        '''
+
+        n = min(len(samples), self.capacity - self.count)
+        records = self.records[self.count:self.count + n]
+        records['time'] = times[:n]
+        records['values'] = samples[:n]
+
+        first = -(-self.count // INDEX_STRIDE) * INDEX_STRIDE
+        self.count += n
+        if first < self.count:
+            self.index = np.append(self.index,
+                                   self.records['time'][first:self.count:INDEX_STRIDE])
+        return n
+
+    def commit(self):
+        '''
+        Writes the appended records to disk, then the header counting
+        them, so that a power cut never leaves counted garbage.
+        '''
+
+        if self.committed == self.count:
+            return
+
+        # msync works on whole pages
+        start = (_HEADER_SIZE + self.committed * self.dtype.itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = _HEADER_SIZE + self.count * self.dtype.itemsize
+        self._map.flush(start, end - start)
+
+        self._write_header(self.count)
+        self._map.flush(0, mmap.PAGESIZE)
+        self.committed = self.count
+
+    def time_range(self):
+        '''
+        Returns the times of the first and last records, None if empty
+        '''
+        if not self.count:
+            return None
+        return self.records['time'][0], self.records['time'][self.count - 1]
+
+    def find(self, start, end):
+        '''
+        Returns the records between two times, as a view. The sparse
+        index narrows the binary search to INDEX_STRIDE records.
+        '''
+
+        bounds = []
+        for t in (start, end):
+            block = max(np.searchsorted(self.index, t, side='left') - 1, 0)
+            lo = block * INDEX_STRIDE
+            hi = min(lo + 2 * INDEX_STRIDE, self.count)
+            bounds.append(lo + np.searchsorted(self.records['time'][lo:hi], t, side='left'))
+
+        return self.records[bounds[0]:bounds[1]]
+
+    def close(self):
+        self.commit()
+        # the views returned by find() reference the map, which is
+        # unmapped when the last of them is gone: closing it now would
+        # leave them pointing to unmapped memory
+        del self.records
+        self._map = None
+        self._file.close()
+
+
+def _number(path):
+    '''
+    returns: the number of a segment file
+    '''
+    return int(os.path.basename(path)[8:14])
+
+
+class Recorder():
+    '''
+    Appends the samples to segment files in a directory, and finds
+    them back by time. The samples are copied to the mapped files as
+    they come, and written to disk in batches by a flusher thread,
+    every recorder_flush_interval seconds.
+
+    The recorded times never decrease: they come from a monotonic
+    clock set to the wall time when the recorder starts, and a block
+    of samples never starts before the end of the previous one.
+
+    Example usage:
+
+    ```
+    for times, pressures in recorder.query('pressure', t1, t2):
+        ...
+    ```
+    '''
+
+    def __init__(self, config):
+        '''
+        Constructor
+
+        Opens the last segment in the recorder_path directory, or
+        creates one, and starts the flusher thread. The segments
+        recorded with other fields (e.g. by another firmware) are
+        renamed to *.stale and left aside.
+
+        arguments:
+        - config: the config dictionary
+        '''
+
+        self.path = config['recorder_path']
+        self.fields = config['get_all_fields']
+        self._index = {name: i for i, name in enumerate(self.fields)}
+        self._sampling = config['sampling_interval']
+        self._capacity = config.get('recorder_segment_records', 36000)
+        self._max_segments = config.get('recorder_max_segments', 72)
+        self._flush_interval = config.get('recorder_flush_interval', 1)
+
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = Lock()
+        self._segments = []
+        self._next_number = 0
+        for path in sorted(glob.glob(os.path.join(self.path, 'segment_*.mvmrec'))):
+            self._next_number = max(self._next_number, _number(path) + 1)
+            try:
+                self._segments.append(Segment(path, self.fields, self._capacity))
+            except ValueError as error:
+                print('ERROR: Recorder setting aside', error)
+                os.replace(path, path + '.stale')
+        if not self._segments or self._segments[-1].full:
+            self._new_segment()
+
+        # the times of the samples, after the ones recorded already
+        span = self._segments[-1].time_range()
+        if span is None and len(self._segments) > 1:
+            span = self._segments[-2].time_range()
+        self._clock = SampleClock(self._sampling,
+                                  -np.inf if span is None else span[1])
+
+        self._stop = Event()
+        self._flusher = Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _new_segment(self):
+        '''
+        Opens a new segment file, removing the oldest ones beyond
+        recorder_max_segments
+        '''
+
+        path = os.path.join(self.path, 'segment_%06d.mvmrec' % self._next_number)
+        self._next_number += 1
+        self._segments.append(Segment(path, self.fields, self._capacity))
+
+        while len(self._segments) > self._max_segments:
+            oldest = self._segments.pop(0)
+            oldest.close()
+            os.remove(oldest.path)
+
+    def add_samples(self, samples, now=None):
+        '''
+        Records a block of samples, the last one taken now and the
+        previous ones one sampling_interval apart. If the block would
+        start before the end of the previous one (blocks of different
+        sizes, a clock step), it is moved just after it.
+
+        arguments:
+        - samples: a 2-D block of samples, one row per sample in
+                   get_all_fields order
+        - now: the time of the last sample, default the SampleClock
+               of the recorder
+        '''
+
+        if not len(samples):
+            return
+
+        times = self._clock.times(len(samples), now)
+
+        with self._lock:
+            while len(samples):
+                if self._segments[-1].full:
+                    self._segments[-1].commit()
+                    self._new_segment()
+                n = self._segments[-1].append(times, samples)
+                times, samples = times[n:], samples[n:]
+
+    def _flush_loop(self):
+        '''
+        The body of the flusher thread
+        '''
+
+        while not self._stop.wait(self._flush_interval):
+            with self._lock:
+                self._segments[-1].commit()
+
+    def query(self, field, start, end):
+        '''
+        Returns the recorded values of a field between two times
+
+        arguments:
+        - field: the field name
+        - start, end: the time range, in seconds since the epoch
+
+        returns: a list of (times, values) pairs, one per segment
+        overlapping the range, as views on the mapped files (they
+        stay valid after close()).
+        '''
+
+        i = self._index[field]
+        result = []
+        with self._lock:
+            for segment in self._segments:
+                span = segment.time_range()
+                if span is None or span[1] < start or span[0] >= end:
+                    continue
+                records = segment.find(start, end)
+                result.append((records['time'], records['values'][:, i]))
+        return result
+
+    def close(self):
+        '''
+        Stops the flusher thread and commits the pending records
+        '''
+
+        self._stop.set()
+        self._flusher.join()
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
@@ -0,0 +1,72 @@
+'''
+A fixed size circular buffer for the plotted data.
+'''
+
+import numpy as np
+
+
+class RingBuffer():
+    '''
+    Keeps the last 'size' values with an O(1) append.
+
+    Every value is stored twice, at index i and i + size, so the
+    values from the oldest to the newest are always a contiguous slice
+    of the storage: view() returns them without copying or rolling.
+
+    Views share the storage and change as values are appended: copy
+    them if they have to stay still.
+    '''
+
+    def __init__(self, size, fill=0.):
+        '''
+        Constructor
+
+        arguments:
+        - size: the number of values kept
+        - fill: the initial value
+        '''
+
+        self._size = size
+        self._storage = np.full(2 * size, fill, dtype=float)
+        self._head = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def head(self):
+        '''
+        The index, in storage order, where the next value goes
+        '''
+        return self._head
+
+    def append(self, value):
+        '''
+        Appends a value, dropping the oldest one
+        '''
+
+        self._storage[self._head] = value
+        self._storage[self._head + self._size] = value
+
+        self._head += 1
+        if self._head == self._size:
+            self._head = 0
+
+    def view(self):
+        '''
+        Returns the values from the oldest to the newest, as a view
+        '''
+        return self._storage[self._head:self._head + self._size]
+
+    def raw(self):
+        '''
+        Returns the values in storage order, i.e. each value at its
+        index modulo size (the newest one is at head - 1), as a view
+        '''
+        return self._storage[:self._size]
+
+    def last(self):
+        '''
+        Returns the newest value
+        '''
+        return self._storage[self._head + self._size - 1]
@@ -0,0 +1,63 @@
+'''
+Gives the times of the blocks of samples received from the ESP.
+'''
+
+import time
+import numpy as np
+
+
+class SampleClock():
+    '''
+    Dates the blocks of samples, the last one taken now and the
+    previous ones one sampling interval apart.
+
+    The times never decrease: they come from a monotonic clock set to
+    the wall time when the SampleClock is created, and a block that
+    would start before the end of the previous one (blocks of
+    different sizes, a clock step) is moved just after it.
+
+    Example usage:
+
+    ```
+    times = clock.times(len(samples))
+    ```
+    '''
+
+    def __init__(self, sampling, last=-np.inf):
+        '''
+        Constructor
+
+        arguments:
+        - sampling: the sampling interval in seconds
+        - last: the time of the last sample already dated, e.g. by a
+                previous run
+        '''
+
+        self.sampling = sampling
+        self.last = last
+        self._epoch = time.time() - time.monotonic()
+
+    def now(self):
+        '''
+        returns: the current time, in seconds since the epoch
+        '''
+        return self._epoch + time.monotonic()
+
+    def times(self, count, now=None):
+        '''
+        Dates a block of samples
+
+        arguments:
+        - count: the number of samples in the block
+        - now: the time of the last sample, default now()
+
+        returns: the times of the samples, as an array
+        '''
+
+        if now is None:
+            now = self.now()
+        start = max(now - self.sampling * (count - 1), self.last + self.sampling)
+        times = start + self.sampling * np.arange(count)
+        if count:
+            self.last = times[-1]
+        return times
@@ -0,0 +1,99 @@
+'''
+A columnar circular store for the samples read from the ESP.
+'''
+
+import numpy as np
+
+
+class SampleStore():
+    '''
+    Keeps the last 'size' samples of several fields in one 2-D float
+    array, one row per field (in get_all_fields order) and one column
+    per sample. Whole samples, or blocks of them, are appended at once.
+
+    As in RingBuffer, every sample is stored twice, so each field
+    from the oldest to the newest sample is a contiguous view.
+    '''
+
+    def __init__(self, fields, size, fill=0.):
+        '''
+        Constructor
+
+        arguments:
+        - fields: the field names, in the order of the sample values
+        - size: the number of samples kept
+        - fill: the initial value
+        '''
+
+        self.fields = list(fields)
+        self._index = {name: i for i, name in enumerate(self.fields)}
+        self._size = size
+        self._storage = np.full((len(self.fields), 2 * size), fill, dtype=float)
+        self._head = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, name):
+        return name in self._index
+
+    @property
+    def head(self):
+        '''
+        The index, in storage order, where the next sample goes
+        '''
+        return self._head
+
+    def index(self, name):
+        '''
+        Returns the position of a field in the samples
+        '''
+        return self._index[name]
+
+    def append(self, samples):
+        '''
+        Appends samples, dropping the oldest ones
+
+        arguments:
+        - samples: a sample (one value per field) or a 2-D block of
+                   them, one row per sample
+        '''
+
+        samples = np.atleast_2d(samples)
+        count = len(samples)
+        if count > self._size:
+            # only the last ones are kept, where they would have gone
+            self._head = (self._head + count - self._size) % self._size
+            samples = samples[-self._size:]
+            count = self._size
+
+        columns = samples.T
+        first = min(count, self._size - self._head)
+        for start in (self._head, self._head + self._size):
+            self._storage[:, start:start + first] = columns[:, :first]
+        if first < count:
+            for start in (0, self._size):
+                self._storage[:, start:start + count - first] = columns[:, first:]
+
+        self._head = (self._head + count) % self._size
+
+    def view(self, name):
+        '''
+        Returns the values of a field from the oldest to the newest
+        sample, as a view
+        '''
+        i = self._index[name]
+        return self._storage[i, self._head:self._head + self._size]
+
+    def raw(self, name):
+        '''
+        Returns the values of a field in storage order (the newest one
+        is at head - 1), as a view
+        '''
+        return self._storage[self._index[name], :self._size]
+
+    def last(self, name):
+        '''
+        Returns the newest value of a field
+        '''
+        return self._storage[self._index[name], self._head + self._size - 1]
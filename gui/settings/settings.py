@@ -7,6 +7,7 @@ import copy
 from .settingsfile import SettingsFile
 
 from presets.presets import Presets
+from messagebox import MessageBox
 
 class Settings(QtWidgets.QMainWindow):
     def __init__(self, mainparent, *args):
@@ -22,6 +23,7 @@ class Settings(QtWidgets.QMainWindow):
         # Get access to parent widgets and data
         self._config = self.mainparent.config
         self._data_h = self.mainparent._data_h
+        self._journal = self.mainparent.journal
         self._toolsettings = self.mainparent.toolsettings
         # self._start_stop_worker = self.mainparent._start_stop_worker
 
@@ -277,10 +279,14 @@ class Settings(QtWidgets.QMainWindow):
 
     def send_values_to_hardware(self):
         '''
-        Sends the currently set values to the ESP
+        Sends the currently set values to the ESP, and adds the
+        changed ones to the journal
         '''
 
         settings_to_file = {}
+        to_send = []
+        buttons = []
+        changes = []
         for param, btn in self._all_spinboxes.items():
             settings_to_file[param] = self._current_values[param]
 
@@ -302,22 +308,52 @@ class Settings(QtWidgets.QMainWindow):
             if self._debug: print('Setting value of', param, ':', value)
 
             # Update the value in the config file
+            previous = self._config[param].get('current')
+            if previous is None:
+                changes.append('%s: %s' % (param, self._current_values[param]))
+            elif previous != self._current_values[param]:
+                changes.append('%s: %s -> %s' % (param, previous, self._current_values[param]))
             self._config[param]['current'] = self._current_values[param]
 
             # Set color to red until we know the value has been set.
             btn.setStyleSheet("color: red")
 
             esp_param_name = self._config['esp_settable_param'][param]
-            status = self._data_h.set_data(esp_param_name, value)
-
-            if status:
-                # Now set the color to green, as we know it has been set
-                btn.setStyleSheet("color: green")
+            to_send.append((esp_param_name, value))
+            buttons.append(btn)
 
             if param == 'respiratory_rate':
                 self.toolsettings_lookup["respiratory_rate"].update(value)
             elif param == 'insp_expir_ratio':
                 self.toolsettings_lookup["insp_expir_ratio"].update(self._current_values[param])
+
+        def set_colors(statuses):
+            # Now set the color to green, as we know it has been set
+            for btn, status in zip(buttons, statuses):
+                if status:
+                    btn.setStyleSheet("color: green")
+
+            # the values still in red were refused
+            refused = [name for (name, _), status in zip(to_send, statuses) if not status]
+            if refused:
+                signal_error(Exception('Values not set: ' + ', '.join(refused)))
+
+        def signal_error(error):
+            msg = MessageBox()
+            fn = msg.critical("Critical",
+                              "Severe hardware communication error",
+                              str(error),
+                              "Communication error",
+                              { msg.Ok: lambda: None })
+            fn()
+
+        # All the values are sent in a single batch
+        self._data_h.set_data_batch(to_send, callback=set_colors,
+                                    errback=signal_error)
+
+        for change in changes:
+            self._journal.add('setting', change)
+
         settings_file = SettingsFile(self._config["settings_file_path"])
         settings_file.store(settings_to_file)
 
@@ -0,0 +1,71 @@
+'''
+Running minimum and maximum over the last values of a series.
+'''
+
+from collections import deque
+
+
+class SlidingMinMax():
+    '''
+    Tracks the minimum and the maximum of the last 'size' values
+    pushed, in amortized O(1) per value.
+
+    Two monotonic deques hold the (index, value) pairs that can still
+    become the minimum (increasing values) or the maximum (decreasing
+    values) of the window; older or dominated values are dropped as
+    new ones come.
+    '''
+
+    def __init__(self, size, fill=0.):
+        '''
+        Constructor
+
+        arguments:
+        - size: the number of values in the window
+        - fill: the value the window is initially filled with
+        '''
+
+        self._size = size
+        self._count = size
+        self._min = deque([(size - 1, fill)])
+        self._max = deque([(size - 1, fill)])
+
+    def push(self, value):
+        '''
+        Adds a value to the window, dropping the oldest one
+        '''
+
+        index = self._count
+        self._count += 1
+        oldest = self._count - self._size
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((index, value))
+        if self._min[0][0] < oldest:
+            self._min.popleft()
+
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((index, value))
+        if self._max[0][0] < oldest:
+            self._max.popleft()
+
+    def extend(self, values):
+        '''
+        Adds several values, in order
+        '''
+        for value in values:
+            self.push(value)
+
+    def min(self):
+        '''
+        Returns the minimum of the window
+        '''
+        return self._min[0][1]
+
+    def max(self):
+        '''
+        Returns the maximum of the window
+        '''
+        return self._max[0][1]
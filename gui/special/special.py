@@ -106,10 +106,11 @@ class SpecialBar(QtWidgets.QWidget):
         Sends signal the appropriate signal the ESP
         to pause inpiration or expiration.
         '''
-        try:
-            if not self._data_h.set_data(mode, int(pause)):
-                raise Exception('Call to set_data failed.')
-        except Exception as error:
+        def check_status(status):
+            if not status:
+                signal_error(Exception('Call to set_data failed.'))
+
+        def signal_error(error):
             msg = MessageBox()
             fn = msg.critical("Critical",
                               "Severe hardware communication error",
@@ -118,6 +119,9 @@ class SpecialBar(QtWidgets.QWidget):
                               { msg.Ok: lambda: self.stop_timer() })
             fn()
 
+        self._data_h.set_data(mode, int(pause),
+                              callback=check_status, errback=signal_error)
+
     def stop_timer(self):
         '''
         Stops the QTimer which sends
@@ -11,7 +11,8 @@ class StartStopWorker():
     A class entirely dedicated to start and stop
     the ventilator, and also to set the ventilator
     mode. For now, this is called only from the
-    mainwindow.
+    mainwindow. The starts, stops and mode changes
+    are added to the journal.
     '''
     MODE_STOP = -1
     MODE_AUTO = 0
@@ -21,7 +22,7 @@ class StartStopWorker():
     DONOT_RUN = 0
 
     def __init__(self, main_window, config, esp32, button_startstop,
-            button_autoassist, toolbar, settings):
+            button_autoassist, toolbar, settings, journal=None):
         self.main_window = main_window
         self.config = config
         self.esp32 = esp32
@@ -29,6 +30,7 @@ class StartStopWorker():
         self.button_autoassist = button_autoassist
         self.toolbar = toolbar
         self.settings = settings
+        self.journal = journal
 
         self.mode_text = "PCV"
 
@@ -36,6 +38,13 @@ class StartStopWorker():
         self.run  = self.DONOT_RUN
         return
 
+    def _log(self, kind, text):
+        '''
+        Adds an event to the journal, if any
+        '''
+        if self.journal is not None:
+            self.journal.add(kind, text)
+
     def raise_comm_error(self, message):
         """
         Opens an error window with 'message'.
@@ -61,6 +70,7 @@ class StartStopWorker():
                 self.button_autoassist.setText("Set\nPCV")
                 self.update_startstop_text()
                 self.mode = self.MODE_ASSIST
+                self._log('mode', self.mode_text)
             else:
                 self.raise_comm_error('Cannot set assisted mode.')
 
@@ -72,6 +82,7 @@ class StartStopWorker():
                 self.button_autoassist.setText("Set\nPSV")
                 self.update_startstop_text()
                 self.mode = self.MODE_AUTO
+                self._log('mode', self.mode_text)
             else:
                 self.raise_comm_error('Cannot set automatic mode.')
 
@@ -163,6 +174,7 @@ class StartStopWorker():
 
             if result:
                 self.run = self.DO_RUN
+                self._log('start', self.mode_text)
                 self.start_button_pressed()
             else:
                 self.raise_comm_error('Cannot start ventilator.')
@@ -176,6 +188,7 @@ class StartStopWorker():
 
                 if result:
                     self.run = self.DONOT_RUN
+                    self._log('stop', self.mode_text)
                     self.stop_button_pressed()
                 else:
                     self.raise_comm_error('Cannot stop ventilator.')
@@ -187,6 +200,7 @@ class StartStopWorker():
         changes the test in the bottons and status.
         '''
         self.run = self.DONOT_RUN
+        self._log('stop', '%s, stopped by the hardware' % self.mode_text)
         self.stop_button_pressed()
 
     def set_run(self, run):
@@ -0,0 +1,25 @@
+import os
+import sys
+import glob
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from blackbox import BlackBox
+
+
+def test_capture_times_never_decrease(tmp_path):
+    blackbox = BlackBox({'blackbox_path': str(tmp_path), 'get_all_fields': ['pressure'],
+                         'sampling_interval': 0.1, 'blackbox_pre_trigger': 2,
+                         'blackbox_post_trigger': 1})
+    blackbox.add_samples(np.zeros((5, 1)), now=1000.5)
+    # a longer block, backdated before the end of the previous one
+    blackbox.add_samples(np.zeros((7, 1)), now=1001.0)
+    blackbox.trigger('test', now=1001.0)
+    # a clock step backwards
+    blackbox.add_samples(np.zeros((20, 1)), now=900.)
+    blackbox.close()
+
+    capture, = glob.glob(str(tmp_path / 'blackbox_*.npz'))
+    times = np.load(capture)['times']
+    assert len(times) == 22
+    assert np.allclose(np.diff(times), 0.1)
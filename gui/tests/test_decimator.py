@@ -0,0 +1,23 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from decimator import Decimator
+
+
+def test_lttb_neighbours_in_time_order():
+    rng = np.random.default_rng(0)
+    values = np.cumsum(rng.normal(size=1000))
+    head = 370
+
+    # the same values, in a looping buffer and in time order
+    looping = Decimator(1000, 100, 'lttb')
+    looping.update(np.roll(values, head), head, 5000)
+    ordered = Decimator(1000, 100, 'lttb')
+    ordered.update(values, 0, 5000)
+
+    index, points = looping.scrolling()
+    expected_index, expected_points = ordered.scrolling()
+    assert np.array_equal(index, expected_index)
+    assert np.array_equal(points, expected_points)
@@ -0,0 +1,44 @@
+import os
+import sys
+import glob
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from recorder import Recorder
+
+
+def _config(path, fields):
+    return {'recorder_path': str(path), 'get_all_fields': fields,
+            'sampling_interval': 0.1, 'recorder_segment_records': 100,
+            'recorder_max_segments': 4, 'recorder_flush_interval': 0.05}
+
+
+def test_reopen_with_other_fields(tmp_path):
+    recorder = Recorder(_config(tmp_path, ['pressure', 'flow']))
+    recorder.add_samples(np.ones((10, 2)), now=1000.)
+    recorder.close()
+
+    # e.g. a newer firmware adds a field
+    recorder = Recorder(_config(tmp_path, ['pressure', 'flow', 'o2']))
+    recorder.add_samples(np.full((5, 3), 2.), now=2000.)
+    times, values = recorder.query('o2', 0, 3000)[0]
+    assert list(values) == [2.] * 5
+    recorder.close()
+
+    assert [os.path.basename(p) for p in sorted(glob.glob(str(tmp_path / '*')))] == [
+        'segment_000000.mvmrec.stale', 'segment_000001.mvmrec']
+
+
+def test_times_never_decrease(tmp_path):
+    recorder = Recorder(_config(tmp_path, ['pressure']))
+    recorder.add_samples(np.zeros((5, 1)), now=1000.5)
+    # a longer block, backdated before the end of the previous one
+    recorder.add_samples(np.zeros((7, 1)), now=1001.0)
+    # a clock step backwards
+    recorder.add_samples(np.zeros((3, 1)), now=900.)
+    times, _ = recorder.query('pressure', 0, 2000)[0]
+    recorder.close()
+
+    assert len(times) == 15
+    assert np.allclose(np.diff(times), 0.1)
+    assert np.isclose(times[0], 1000.1)
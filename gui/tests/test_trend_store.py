@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from trend_store import TrendStore
+
+
+def _config(levels):
+    return {'get_all_fields': ['pressure'], 'sampling_interval': 0.1,
+            'trend_levels': levels}
+
+
+def test_mixed_blocks_never_go_back():
+    trends = TrendStore(_config([[1, 10], [10, 10]]))
+    trends.add_samples(np.ones((1, 1)), now=10.02)
+    # a longer block, backdated before the end of the previous one
+    trends.add_samples(np.ones((3, 1)), now=10.12)
+    trends.add_samples(np.ones((25, 1)), now=12.5)
+    # a clock step backwards
+    trends.add_samples(np.ones((4, 1)), now=5.)
+    trends.add_samples(np.ones((20, 1)), now=16.)
+
+    for level in trends.levels:
+        times = level.times.view()
+        assert np.all(np.diff(times[np.isfinite(times)]) > 0)
+
+    times, mins, maxs, means = trends.query('pressure', 0, 100)
+    assert list(times) == [10., 11., 12., 13., 14., 15.]
+    assert np.allclose(means, 1.)
@@ -0,0 +1,205 @@
+'''
+Long term trends of the observables, at several resolutions.
+'''
+
+import numpy as np
+from ring_buffer import RingBuffer
+from sample_clock import SampleClock
+from sample_store import SampleStore
+
+
+class TrendLevel():
+    '''
+    The min, max, sum and count of each field over consecutive
+    periods of a fixed length, for the last 'size' periods.
+    '''
+
+    def __init__(self, fields, period, size):
+        '''
+        Constructor
+
+        arguments:
+        - fields: the field names
+        - period: the aggregation period in seconds
+        - size: the number of periods kept
+        '''
+
+        self.period = period
+        self.size = size
+
+        # the start time of each period, -inf where there is none yet,
+        # so that the times are always sorted
+        self.times = RingBuffer(size, fill=-np.inf)
+        self.min = SampleStore(fields, size, fill=np.nan)
+        self.max = SampleStore(fields, size, fill=np.nan)
+        self.sum = SampleStore(fields, size)
+        self.count = RingBuffer(size)
+
+        # the period being aggregated
+        self._start = None
+        self._acc = None
+
+    def add(self, start, mins, maxs, sums, count):
+        '''
+        Aggregates values into the current period. When a value
+        belongs to a later period, the current one is complete: it is
+        stored and returned. A value belonging to an earlier period is
+        merged into the current one, so the times never decrease.
+
+        arguments:
+        - start: the time of the values, in seconds
+        - mins, maxs, sums: the per field min, max and sum
+        - count: the number of samples aggregated in the values
+
+        returns: the completed period as (start, min, max, sum, count),
+        or None
+        '''
+
+        start = start - start % self.period
+        completed = None
+
+        if self._start is not None and start > self._start:
+            completed = self._flush()
+        elif self._start is not None:
+            start = self._start
+
+        if self._acc is None:
+            self._start = start
+            self._acc = [mins.copy(), maxs.copy(), sums.copy(), count]
+        else:
+            acc = self._acc
+            np.minimum(acc[0], mins, out=acc[0])
+            np.maximum(acc[1], maxs, out=acc[1])
+            acc[2] += sums
+            acc[3] += count
+
+        return completed
+
+    def _flush(self):
+        '''
+        Stores the current period and starts a new one
+
+        returns: the stored period as (start, min, max, sum, count)
+        '''
+
+        mins, maxs, sums, count = self._acc
+        self.times.append(self._start)
+        self.min.append(mins)
+        self.max.append(maxs)
+        self.sum.append(sums)
+        self.count.append(count)
+
+        completed = (self._start, mins, maxs, sums, count)
+        self._start = None
+        self._acc = None
+        return completed
+
+    def first_time(self):
+        '''
+        Returns the start of the oldest period kept, None if empty
+        '''
+        times = self.times.view()
+        valid = np.searchsorted(times, -np.inf, side='right')
+        return times[valid] if valid < len(times) else None
+
+
+class TrendStore():
+    '''
+    Keeps cascading aggregates of the samples: each level aggregates
+    the periods completed by the previous one (e.g. 1 s, 10 s, 1 min
+    and 10 min). The memory used is fixed by the number of periods
+    kept per level, however long the GUI runs. The samples are dated
+    by a SampleClock, so the times never decrease.
+
+    Example usage:
+
+    ```
+    times, mins, maxs, means = trends.query('pressure', start, end, 500)
+    ```
+    '''
+
+    def __init__(self, config):
+        '''
+        Constructor
+
+        arguments:
+        - config: the config dictionary, with the get_all_fields,
+                  sampling_interval and trend_levels keys
+        '''
+
+        self.fields = config['get_all_fields']
+        self._clock = SampleClock(config['sampling_interval'])
+        self.levels = [TrendLevel(self.fields, period, size)
+                       for period, size in config['trend_levels']]
+
+    def add_samples(self, samples, now=None):
+        '''
+        Adds a block of samples, the last one taken now and the
+        previous ones one sampling_interval apart, moved after the
+        previous block if they would overlap it.
+
+        arguments:
+        - samples: a 2-D block of samples, one row per sample in
+                   get_all_fields order
+        - now: the time of the last sample, default the SampleClock
+               of the store
+        '''
+
+        if not len(samples):
+            return
+
+        times = self._clock.times(len(samples), now)
+
+        # split the block where the finest level period changes
+        level = self.levels[0]
+        periods = np.floor_divide(times, level.period)
+        splits = np.flatnonzero(np.diff(periods)) + 1
+
+        for rows, start in zip(np.split(samples, splits),
+                               np.split(times, splits)):
+            completed = level.add(start[0], rows.min(axis=0), rows.max(axis=0),
+                                  rows.sum(axis=0), len(rows))
+
+            # a completed period is aggregated by the next level, and so on
+            for coarser in self.levels[1:]:
+                if completed is None:
+                    break
+                completed = coarser.add(*completed)
+
+    def query(self, field, start, end, max_points=None):
+        '''
+        Returns the trend of a field between two times, from the
+        finest level that covers the start time and, if max_points
+        is given, has at most max_points periods in the range.
+
+        arguments:
+        - field: the field name
+        - start, end: the time range, in seconds since the epoch
+        - max_points: the maximum number of periods returned
+
+        returns: the start times of the periods, and the min, max
+        and mean of the field over each period, as arrays.
+        '''
+
+        # if no level goes back to the start time, the finest one
+        # fitting max_points is used
+        fitting = None
+        for level in self.levels:
+            first = level.first_time()
+            covers = first is not None and first <= start
+            fits = max_points is None or (end - start) / level.period <= max_points
+            if fits and fitting is None:
+                fitting = level
+            if covers and fits:
+                break
+        else:
+            level = fitting or self.levels[-1]
+
+        times = level.times.view()
+        begin, stop = np.searchsorted(times, [start, end])
+
+        count = level.count.view()[begin:stop]
+        return (times[begin:stop].copy(),
+                level.min.view(field)[begin:stop].copy(),
+                level.max.view(field)[begin:stop].copy(),
+                level.sum.view(field)[begin:stop] / count)
@@ -46,6 +46,12 @@ unsigned long now()
 
 unsigned long pause_lg_expiration = time::now<time::Seconds>() + 10;
 
+// streaming mode: telemetry pushed every stream_period milliseconds
+bool streaming = false;
+bool stream_frames = false;
+unsigned long stream_period = 100;
+unsigned long stream_last = 0;
+
 void setup()
 {
   Serial.begin(115200);
@@ -72,6 +78,51 @@ void setup()
   parameters["backup_enable"]    = String(1);
   parameters["backup_min_rate"]  = String(10);
   parameters["pause_lg_time"]    = "10";
+
+  // protocol extensions understood by this firmware
+  parameters["protocol"] = "frame,stream,pipeline,many";
+}
+
+// standard CRC-32 (same as zlib.crc32), bitwise to save flash
+uint32_t crc32(uint8_t const* data, size_t length)
+{
+  uint32_t crc = 0xFFFFFFFF;
+  for (size_t i = 0; i < length; ++i) {
+    crc ^= data[i];
+    for (int bit = 0; bit < 8; ++bit) {
+      crc = (crc >> 1) ^ (0xEDB88320 & -(crc & 1));
+    }
+  }
+  return ~crc;
+}
+
+// binary version of "get all":
+// magic (0xA5 0x5A) | length (uint16 LE) | float32 LE values | crc32 LE
+void send_frame(Stream& connection)
+{
+  float const values[] = {
+      float(random(20, 70))     // pressure
+    , float(random(3, 21))      // flow
+    , float(random(30, 100))    // o2
+    , float(random(6, 8))       // bpm
+    , float(random(1000, 1500)) // tidal
+    , float(random(4, 20))      // peep
+    , float(random(10, 50))     // temperature
+    , float(random(0, 1))       // power_mode
+    , float(random(20, 100))    // battery
+    , float(random(70, 80))     // peak
+    , float(random(1000, 2000)) // total_inspired_volume
+    , float(random(1000, 2000)) // total_expired_volume
+    , float(random(10, 100))    // volume_minute
+  };
+  uint16_t const length = sizeof(values);
+  uint32_t const crc = crc32(reinterpret_cast<uint8_t const*>(values), length);
+
+  uint8_t const header[] = { 0xA5, 0x5A, uint8_t(length & 0xFF), uint8_t(length >> 8) };
+  connection.write(header, sizeof(header));
+  // the ESP32 is little endian, as the wire format
+  connection.write(reinterpret_cast<uint8_t const*>(values), length);
+  connection.write(reinterpret_cast<uint8_t const*>(&crc), sizeof(crc));
 }
 
 // this is tricky, didn't had the time to think a better algo
@@ -102,12 +153,9 @@ String set(String const& command)
   return "OK";
 }
 
-String get(String const& command)
+String all_values()
 {
-  auto const name = parse_word(command);
-
-  if (name == "all") {
-    return
+  return
         String(random(20, 70))     + "," // pressure
       + String(random(3, 21))      + "," // flow
       + String(random(30, 100))    + "," // o2
@@ -121,6 +169,32 @@ String get(String const& command)
       + String(random(1000, 2000)) + "," // total_inspired_volume
       + String(random(1000, 2000)) + "," // total_expired_volume
       + String(random(10, 100));         // volume_minute
+}
+
+// "stream on <period ms> [frame]" or "stream off"
+String stream(String const& command)
+{
+  auto const what = parse_word(command);
+
+  if (what == "on") {
+    auto const period = parse_word(command.substring(7));
+    stream_period = period.toInt() > 0 ? period.toInt() : 100;
+    stream_frames = command.endsWith(" frame");
+    stream_last = millis();
+    streaming = true;
+  } else if (what == "off") {
+    streaming = false;
+  } else {
+    return "notok";
+  }
+
+  return "OK";
+}
+
+String get_value(String const& name)
+{
+  if (name == "all") {
+    return all_values();
   } else if (name == "pause_lg_time") {
     auto const now = time::now<time::Seconds>();
     return now > pause_lg_expiration ? "0" : String(pause_lg_expiration - now);
@@ -141,20 +215,62 @@ String get(String const& command)
   }
 }
 
+// "get a,b,c" replies with all the values, comma separated
+String get(String const& command)
+{
+  auto const names = parse_word(command);
+
+  String reply;
+  int start = 0;
+  while (true) {
+    auto const end = names.indexOf(',', start);
+    if (end == -1) {
+      return reply + get_value(names.substring(start));
+    }
+    reply += get_value(names.substring(start, end)) + ",";
+    start = end + 1;
+  }
+}
+
 void serial_loop(Stream& connection)
 {
   if (connection.available() > 0) {
     String command = connection.readStringUntil(terminator);
     command.trim();
+
+    // pipelined commands are prefixed by "#<tag> ", echoed in the reply
+    String tag = "";
+    if (command.startsWith("#")) {
+      auto const tag_end = command.indexOf(separator);
+      tag = command.substring(0, tag_end + 1);
+      command = command.substring(tag_end + 1);
+    }
+
     auto const command_type = command.substring(0, 3);
 
     if (command.length() == 0) {
+    } else if (command == "get all_frame") {
+      send_frame(connection);
     } else if (command_type == "get") {
-      connection.println("valore=" + get(command));
+      connection.println(tag + "valore=" + get(command));
     } else if (command_type == "set") {
-      connection.println("valore=" + set(command));
+      connection.println(tag + "valore=" + set(command));
+    } else if (command_type == "str") {
+      connection.println(tag + "valore=" + stream(command));
+    } else {
+      connection.println(tag + "valore=notok");
+    }
+  }
+}
+
+void stream_loop(Stream& connection)
+{
+  if (streaming && millis() - stream_last >= stream_period) {
+    stream_last += stream_period;
+    if (stream_frames) {
+      send_frame(connection);
     } else {
-      connection.println("valore=notok");
+      connection.println("stream=" + all_values());
     }
   }
 }
@@ -163,4 +279,5 @@ void loop()
 {
   serial_loop(Serial);
   serial_loop(Debug);
+  stream_loop(Serial);
 }